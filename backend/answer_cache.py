@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+
+def source_signature(docs):
+    return frozenset((doc.metadata.get('doc_id'), doc.metadata.get('chunk')) for doc in docs)
+
+
+class AnswerCache:
+    # Answers keyed by the exact set of chunks the prompt was built from. A question is only compared with
+    # earlier ones that had the same chunks and models, so the similarity scan touches a handful of entries
+    def __init__(self, max_entries=1000, ttl_seconds=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation; an answer generated across one is not stored
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._buckets = defaultdict(set)
+        self._by_doc = defaultdict(set)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._buckets[entry['bucket']].discard(entry_id)
+        if not self._buckets[entry['bucket']]:
+            del self._buckets[entry['bucket']]
+        for doc_id in entry['doc_ids']:
+            self._by_doc[doc_id].discard(entry_id)
+            if not self._by_doc[doc_id]:
+                del self._by_doc[doc_id]
+
+    def get(self, models, signature, embedding, threshold):
+        # embedding=None looks up answers stored without one, which only match their own bucket exactly
+        query = None
+        if embedding is not None:
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+        now = time.monotonic()
+        with self._lock:
+            best_id, best_similarity = None, threshold
+            for entry_id in list(self._buckets.get((models, signature), ())):
+                entry = self._entries[entry_id]
+                if entry['expires'] <= now:
+                    self._remove(entry_id)
+                    continue
+                similarity = 1.0 if query is None else float(entry['embedding'] @ query)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id]['answer']
+
+    def put(self, models, signature, embedding, answer, generation=None):
+        # Pass the generation read before retrieval: if a document was deleted or re-indexed while the answer
+        # was being generated, it may cite chunks that no longer exist
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            doc_ids = {doc_id for doc_id, _ in signature}
+            self._entries[entry_id] = {
+                "bucket": (models, signature),
+                "embedding": vector,
+                "answer": answer,
+                "doc_ids": doc_ids,
+                "expires": time.monotonic() + self.ttl_seconds
+            }
+            self._buckets[(models, signature)].add(entry_id)
+            for doc_id in doc_ids:
+                self._by_doc[doc_id].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_document(self, doc_id):
+        # Any answer citing the document is dropped when it is deleted or re-indexed
+        with self._lock:
+            self.generation += 1
+            for entry_id in list(self._by_doc.get(doc_id, ())):
+                self._remove(entry_id)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._buckets.clear()
+            self._by_doc.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -1,17 +1,30 @@
-from flask import Flask, request, jsonify
+import time
+import_started = time.perf_counter()
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
-import ollama
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import OllamaEmbeddings
-import chromadb
 from werkzeug.utils import secure_filename
-import PyPDF2
-from docx import Document
 import uuid
 import json
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from embedding_cache import EmbeddingCache, CachedEmbeddings, hash_text
+from extraction import is_archive, iter_archive_members, iter_document_chunks, iter_document_sections, load_parsers
+from retrieval_cache import RetrievalCache, normalize_question
+from answer_cache import AnswerCache, source_signature
+from lexical_index import LexicalIndex, identifier_terms, is_keyword_query, reciprocal_rank_fusion
+from ollama_client import OllamaClientEmbeddings, OllamaService
+from jobs import JobQueue
+from metrics import MetricsRegistry, StageTimer
+from pipeline import Pipeline
+from llm_scheduler import GenerationScheduler, SchedulerBusy
+from context_packing import estimate_tokens, pack_context
+from documents import Document
+from vector_store import NUMPY_INDEX_DTYPES, ChromaVectorStore, MigratingVectorStore, NumpyVectorStore
+from storage import ConversationStore, DocumentStore, JobStore, SharedStateStore
 
 app = Flask(__name__)
 CORS(app)
@@ -19,170 +32,1032 @@ CORS(app)
 UPLOAD_FOLDER = '../uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
 CHROMA_PATH = './chroma_db'
+VECTOR_INDEX_PATH = './vector_index'
+VECTOR_BACKENDS = ('chroma', 'numpy')
+# Changing any of these needs new embeddings and a new vector store handle
+VECTOR_STORE_CONFIG_KEYS = (
+    'embedding_model', 'ollama_base_url', 'vector_backend', 'vector_dtype', 'vector_collection', 'embedding_migration'
+)
+DEFAULT_VECTOR_COLLECTION = 'documents'
+# How long the old collection is kept after a migration's cutover, for queries other workers already started on it
+MIGRATION_DROP_GRACE_SECONDS = 60
 METADATA_FILE = './documents_metadata.json'
+DOCUMENTS_DB_FILE = './documents.db'
+LEXICAL_INDEX_FILE = './lexical_index.db'
 CONVERSATIONS_FILE = './conversations.json'
+CONVERSATIONS_DB_FILE = './conversations.db'
 MODEL_CONFIG_FILE = './model_config.json'
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(CHROMA_PATH, exist_ok=True)
+EMBEDDING_CACHE_FILE = './embedding_cache.db'
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+JOBS_DB_FILE = './jobs.db'
+# Held by the one worker process that runs background jobs
+JOB_RUNNER_LOCK_FILE = './jobs.lock'
+SHARED_STATE_DB_FILE = './shared_state.db'
+INGEST_WORKERS = 2
+EMBED_BATCH_SIZE = 64
+EXISTING_CHUNKS_PAGE_SIZE = 1000
+TXT_MAX_CONTENT_LENGTH = 16 * 1024 * 1024 * 1024
+RETRIEVAL_CACHE_MAX_ENTRIES = 1024
+RETRIEVAL_CACHE_TTL_SECONDS = 300
+ANSWER_CACHE_MAX_ENTRIES = 2000
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+# Cosine similarity two questions' embeddings need before one's answer is reused for the other
+DEFAULT_ANSWER_CACHE_THRESHOLD = 0.95
+BATCH_MAX_QUESTIONS = 1000
+BATCH_GENERATION_CONCURRENCY = 4
+# Generations sent to Ollama at once by each worker process; more just make every answer slower
+DEFAULT_LLM_MAX_CONCURRENCY = 2
+LLM_MAX_QUEUE = 64
+LLM_QUEUE_TIMEOUTS = {'interactive': 30, 'batch': 300}
+CONTEXT_CANDIDATES = 8
+DEFAULT_CONTEXT_TOKEN_BUDGET = 800
+DEBUG_TIMINGS_HEADER = 'X-Debug-Timings'
+BULK_MAX_CONTENT_LENGTH = 2 * 1024 * 1024 * 1024
+BULK_MAX_EXTRACTED_BYTES = 8 * 1024 * 1024 * 1024
+BULK_EXTRACT_WORKERS = 4
+BULK_EMBED_BATCH_SIZE = 256
+BULK_QUEUE_SIZE = 8
+BULK_METADATA_BATCH_SIZE = 500
+# Set DOCUQUERY_WARMUP=0 to skip the background warm-up; heavy subsystems then load on first use
+WARMUP_ON_START = os.environ.get('DOCUQUERY_WARMUP', '1') != '0'
+# host:port of a Chroma server. The embedded Chroma database is not safe to share between processes,
+# so deployments with several worker processes should point every worker at one server
+CHROMA_SERVER = os.environ.get('DOCUQUERY_CHROMA_SERVER')
+PROMPT_SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
-chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+# Opened by create_app() rather than at import: extraction worker processes re-run this module as
+# __mp_main__ and must not open the databases or load saved state
+embedding_cache = None
+document_store = None
+conversation_store = None
+lexical_index = None
+job_queue = None
+shared_state = None
+app_initialized = False
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL_SECONDS)
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
+
+metrics = MetricsRegistry()
+stage_timer = StageTimer(metrics.histogram(
+    'docuquery_stage_duration_seconds', 'Time spent in each pipeline stage', ['operation', 'stage']
+))
+http_request_duration = metrics.histogram(
+    'docuquery_http_request_duration_seconds', 'Time until response headers are sent', ['method', 'endpoint', 'status']
+)
+documents_ingested = metrics.counter('docuquery_documents_ingested_total', 'Documents ingested or re-indexed')
+bytes_ingested = metrics.counter('docuquery_ingested_bytes_total', 'Bytes of uploaded files ingested')
+chunks_ingested = metrics.counter('docuquery_ingested_chunks_total', 'Chunks processed during ingestion', ['result'])
+prompt_size = metrics.histogram('docuquery_prompt_chars', 'Size of prompts sent to the LLM', buckets=PROMPT_SIZE_BUCKETS)
+context_chunks = metrics.histogram('docuquery_context_chunks', 'Chunks placed in each prompt', buckets=(0, 1, 2, 3, 5, 8, 13, 21))
+startup_seconds = metrics.gauge('docuquery_startup_seconds', 'Seconds spent importing the app and warming up its subsystems', ['phase'])
+context_tokens = metrics.counter('docuquery_context_tokens_total', 'Estimated context tokens: packed into prompts, removed as duplicate overlap, or dropped over budget', ['result'])
+llm_queue_wait = metrics.histogram('docuquery_llm_queue_wait_seconds', 'Time generations waited for a free LLM slot', ['priority'])
+llm_generations = metrics.counter('docuquery_llm_generations_total', 'Generations by outcome (done, failed, cancelled) and requests coalesced, rejected or timed out in the queue', ['result'])
+llm_queue_depth = metrics.gauge('docuquery_llm_queue_depth', 'Generations waiting for a free LLM slot', ['priority'])
+llm_running = metrics.gauge('docuquery_llm_running', 'Generations currently running')
+cache_entries = metrics.gauge('docuquery_cache_entries', 'Entries held by each cache', ['cache'])
+cache_hit_ratio = metrics.gauge('docuquery_cache_hit_ratio', 'Hit ratio of each cache since startup', ['cache'])
+
+def collect_cache_metrics():
+    caches = {
+        "embeddings": embedding_cache.stats(),
+        "query_embeddings": retrieval_cache.query_embeddings.stats(),
+        "retrieval_results": retrieval_cache.results.stats(),
+        "answers": answer_cache.stats()
+    }
+    for name, stats in caches.items():
+        cache_entries.set(stats['entries'], cache=name)
+        cache_hit_ratio.set(stats['hit_rate'], cache=name)
+
+metrics.add_collector(collect_cache_metrics)
+
+llm_scheduler = GenerationScheduler(
+    DEFAULT_LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUTS,
+    wait_histogram=llm_queue_wait, outcomes=llm_generations
+)
+
+def collect_llm_metrics():
+    stats = llm_scheduler.stats()
+    for priority, depth in stats['queued'].items():
+        llm_queue_depth.set(depth, priority=priority)
+    llm_running.set(stats['running'])
+
+metrics.add_collector(collect_llm_metrics)
 
-documents_metadata = {}
-conversations = []
 model_config = {
     'embedding_model': 'nomic-embed-text',
     'llm_model': 'llama3.2',
-    'ollama_base_url': 'http://localhost:11434'
+    'ollama_base_url': 'http://localhost:11434',
+    'vector_backend': 'chroma',
+    'vector_dtype': 'int8'
 }
 
+# Settings version and change log position this worker has caught up with; see sync_shared_state()
+config_version = 0
+changes_seen = 0
+
 embeddings = None
+vectorstore = None
+ollama_service = None
+# chromadb takes about a second to import, so the client is opened on first use
+chroma_client = None
+init_lock = threading.RLock()
+warmup = {"state": "pending", "error": None, "thread": None}
 
 def load_metadata():
-    global documents_metadata
+    # One-time migration of the legacy JSON file into the document store
     if os.path.exists(METADATA_FILE):
         try:
             with open(METADATA_FILE, 'r') as f:
-                documents_metadata = json.load(f)
+                document_store.import_documents(json.load(f).values())
+            os.replace(METADATA_FILE, METADATA_FILE + '.migrated')
         except Exception as e:
-            print(f"Error loading metadata: {e}")
-            documents_metadata = {}
-
-def save_metadata():
-    try:
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(documents_metadata, f, indent=2)
-    except Exception as e:
-        print(f"Error saving metadata: {e}")
+            print(f"Error migrating metadata: {e}")
 
 def load_conversations():
-    global conversations
+    # One-time migration of the legacy JSON file into the conversation store
     if os.path.exists(CONVERSATIONS_FILE):
         try:
             with open(CONVERSATIONS_FILE, 'r') as f:
-                conversations = json.load(f)
+                conversation_store.import_conversations(json.load(f))
+            os.replace(CONVERSATIONS_FILE, CONVERSATIONS_FILE + '.migrated')
         except Exception as e:
-            print(f"Error loading conversations: {e}")
-            conversations = []
-
-def save_conversations():
-    try:
-        with open(CONVERSATIONS_FILE, 'w') as f:
-            json.dump(conversations, f, indent=2)
-    except Exception as e:
-        print(f"Error saving conversations: {e}")
+            print(f"Error migrating conversations: {e}")
 
 def load_model_config():
-    global model_config, embeddings
-    if os.path.exists(MODEL_CONFIG_FILE):
+    global model_config, embeddings, ollama_service, config_version, changes_seen
+    # One-time migration of the legacy JSON file into the shared store
+    if shared_state.setting_version('model_config') == 0 and os.path.exists(MODEL_CONFIG_FILE):
         try:
             with open(MODEL_CONFIG_FILE, 'r') as f:
-                model_config = json.load(f)
+                if shared_state.save_setting('model_config', json.load(f), 0) is not None:
+                    os.replace(MODEL_CONFIG_FILE, MODEL_CONFIG_FILE + '.migrated')
         except Exception as e:
-            print(f"Error loading model config: {e}")
+            print(f"Error migrating model config: {e}")
     
-    embeddings = OllamaEmbeddings(
-        model=model_config['embedding_model'], 
-        base_url=model_config['ollama_base_url']
-    )
+    stored, config_version = shared_state.get_setting('model_config')
+    if stored is not None:
+        model_config = stored
+    # Caches start empty, so earlier changes need no replay
+    changes_seen = shared_state.latest_change()
+    ollama_service = OllamaService(model_config['ollama_base_url'])
+    embeddings = build_embeddings()
+    llm_scheduler.set_concurrency(model_config.get('llm_max_concurrency', DEFAULT_LLM_MAX_CONCURRENCY))
 
-def save_model_config():
-    try:
-        with open(MODEL_CONFIG_FILE, 'w') as f:
-            json.dump(model_config, f, indent=2)
-    except Exception as e:
-        print(f"Error saving model config: {e}")
+def apply_model_config(config, version):
+    # Swaps in a configuration saved by this or another worker, rebuilding only what the change affects
+    global model_config, embeddings, vectorstore, ollama_service, config_version
+    with init_lock:
+        previous = model_config
+        model_config = config
+        config_version = version
+        llm_scheduler.set_concurrency(config.get('llm_max_concurrency', DEFAULT_LLM_MAX_CONCURRENCY))
+        if config['ollama_base_url'] != previous['ollama_base_url']:
+            previous_service = ollama_service
+            ollama_service = OllamaService(config['ollama_base_url'])
+            ollama_service.start_probe()
+            previous_service.close()
+        if any(config.get(key) != previous.get(key) for key in VECTOR_STORE_CONFIG_KEYS):
+            embeddings = build_embeddings()
+            vectorstore = None
 
-def check_ollama_connection():
-    try:
-        ollama.list(host=model_config['ollama_base_url'])
-        return True, None
-    except Exception as e:
-        return False, str(e)
+def sync_shared_state():
+    # Other workers may have changed the configuration or the documents since this worker last looked.
+    # Two small SQLite reads per request
+    global changes_seen
+    if shared_state.setting_version('model_config') != config_version:
+        apply_model_config(*shared_state.get_setting('model_config'))
+    latest, doc_ids, complete = shared_state.changes_since(changes_seen)
+    if latest != changes_seen:
+        retrieval_cache.invalidate()
+        if complete:
+            for doc_id in doc_ids - {None}:
+                answer_cache.invalidate_document(doc_id)
+        else:
+            answer_cache.clear()
+        changes_seen = latest
+
+def invalidate_caches(doc_id=None):
+    # Pass doc_id when a document's existing chunks changed, so answers citing it are dropped too.
+    # The change is logged for the other workers to replay
+    retrieval_cache.invalidate()
+    if doc_id is not None:
+        answer_cache.invalidate_document(doc_id)
+    shared_state.record_change(doc_id)
+
+def build_embeddings(model=None):
+    model = model or model_config['embedding_model']
+    return CachedEmbeddings(OllamaClientEmbeddings(ollama_service, model), embedding_cache, model)
+
+def get_chroma_client():
+    global chroma_client
+    with init_lock:
+        if chroma_client is None:
+            import chromadb
+            if CHROMA_SERVER:
+                host, _, port = CHROMA_SERVER.partition(':')
+                chroma_client = chromadb.HttpClient(host=host, port=int(port or 8000))
+            else:
+                chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        return chroma_client
+
+def vector_index_path(collection):
+    # The original numpy index lives in VECTOR_INDEX_PATH; collections built by a migration sit beside it
+    if collection == DEFAULT_VECTOR_COLLECTION:
+        return VECTOR_INDEX_PATH
+    return f"{VECTOR_INDEX_PATH}-{collection}"
+
+def open_vector_collection(collection, collection_embeddings, backend=None):
+    # "numpy" keeps quantized vectors in a memory-mapped file in-process; "chroma" is the default
+    if (backend or model_config.get('vector_backend', 'chroma')) == 'numpy':
+        return NumpyVectorStore(
+            vector_index_path(collection), collection_embeddings, dtype=model_config.get('vector_dtype', 'int8')
+        )
+    return ChromaVectorStore(get_chroma_client(), collection, collection_embeddings)
+
+def build_vectorstore():
+    store = open_vector_collection(model_config.get('vector_collection', DEFAULT_VECTOR_COLLECTION), embeddings)
+    migration = model_config.get('embedding_migration')
+    if migration is None:
+        return store
+    # Until cutover, every write also reaches the collection being built with the new model
+    shadow = open_vector_collection(migration['collection'], build_embeddings(migration['embedding_model']))
+    return MigratingVectorStore(store, shadow)
+
+def get_vectorstore():
+    # One handle for the life of the process; only rebuilt when the embedding function changes
+    global vectorstore
+    with init_lock:
+        if vectorstore is None:
+            vectorstore = build_vectorstore()
+        return vectorstore
 
-load_metadata()
-load_conversations()
-load_model_config()
+def check_ollama_connection():
+    # Served from the circuit breaker state, so this never costs a round-trip to Ollama
+    return ollama_service.is_available()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text_from_pdf(filepath):
-    text = ""
-    with open(filepath, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-    return text
-
-def extract_text_from_docx(filepath):
-    doc = Document(filepath)
-    text = ""
-    for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
-
-def extract_text_from_txt(filepath):
-    with open(filepath, 'r', encoding='utf-8') as file:
-        return file.read()
-
-def process_document(filepath, filename, folder=None):
-    ext = filename.rsplit('.', 1)[1].lower()
-    
-    if ext == 'pdf':
-        text = extract_text_from_pdf(filepath)
-    elif ext == 'docx':
-        text = extract_text_from_docx(filepath)
-    elif ext == 'txt':
-        text = extract_text_from_txt(filepath)
-    else:
-        raise ValueError(f"Unsupported file type: {ext}")
-    
-    text_splitter = RecursiveCharacterTextSplitter(
+def max_file_size(filename):
+    # Plain text is streamed through ingestion; pdf/docx parsers load the whole file, so they keep the smaller limit
+    if filename.rsplit('.', 1)[-1].lower() == 'txt':
+        return TXT_MAX_CONTENT_LENGTH
+    return app.config['MAX_CONTENT_LENGTH']
+
+def discard_if_oversized(filepath, filename):
+    if os.path.getsize(filepath) > max_file_size(filename):
+        os.remove(filepath)
+        return True
+    return False
+
+def build_text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         length_function=len
     )
-    chunks = text_splitter.split_text(text)
+
+def chunk_metadata(filename, doc_id, index, page):
+    metadata = {"source": filename, "doc_id": doc_id, "chunk": index}
+    if page is not None:
+        metadata["page"] = page + 1
+    return metadata
+
+def iter_with_preview(sections, preview, limit=500):
+    size = 0
+    for page, text in sections:
+        if size < limit:
+            part = (text if page is None else text + "\n")[:limit - size]
+            preview.append(part)
+            size += len(part)
+        yield page, text
+
+def restore_document_chunks(store, doc_id, inserted_ids, moved_from):
+    # Undoes a re-index that failed midway, so the previous version stays searchable as it was
+    if inserted_ids:
+        store.delete(inserted_ids)
+    if moved_from:
+        store.update_metadatas([chunk_id for chunk_id, _ in moved_from], [metadata for _, metadata in moved_from])
+    lexical_index.delete_document(doc_id)
+    offset = 0
+    while True:
+        existing = store.get(doc_id, limit=EXISTING_CHUNKS_PAGE_SIZE, offset=offset)
+        if existing['ids']:
+            lexical_index.add_chunks(existing['documents'], existing['metadatas'])
+        if len(existing['ids']) < EXISTING_CHUNKS_PAGE_SIZE:
+            break
+        offset += EXISTING_CHUNKS_PAGE_SIZE
+    invalidate_caches(doc_id)
+
+def process_document(filepath, filename, folder=None, doc_id=None, progress=None):
+    progress = progress or (lambda **fields: None)
+    ext = filename.rsplit('.', 1)[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"Unsupported file type: {ext}")
+    
+    text_splitter = build_text_splitter()
     
-    doc_id = str(uuid.uuid4())
+    doc_id = doc_id or str(uuid.uuid4())
     
     is_connected, error = check_ollama_connection()
     if not is_connected:
         raise ConnectionError(f"Cannot connect to Ollama: {error}. Make sure Ollama is running at {model_config['ollama_base_url']}")
     
-    vectorstore = Chroma(
-        client=chroma_client,
-        collection_name="documents",
-        embedding_function=embeddings
+    store = get_vectorstore()
+    timings = defaultdict(float)
+    
+    # Chunks already stored under this doc_id (a revised upload, or a job resumed after a restart) are matched
+    # by content hash: only new or changed chunks are embedded, and chunks that are gone are deleted at the end
+    with stage_timer.accumulate(timings, 'load_existing'):
+        reusable = defaultdict(list)
+        # Paged, keeping only hashes, so re-indexing a very large document doesn't hold its old text in memory
+        offset = 0
+        while True:
+            existing = store.get(doc_id, limit=EXISTING_CHUNKS_PAGE_SIZE, offset=offset)
+            for chunk_id, text, metadata in zip(existing['ids'], existing['documents'], existing['metadatas']):
+                reusable[hash_text(text)].append((chunk_id, metadata))
+            if len(existing['ids']) < EXISTING_CHUNKS_PAGE_SIZE:
+                break
+            offset += EXISTING_CHUNKS_PAGE_SIZE
+    with stage_timer.accumulate(timings, 'lexical_write'):
+        lexical_index.delete_document(doc_id)
+    invalidate_caches(doc_id)
+    
+    progress(stage='processing', chunks_embedded=0, chunks_reused=0)
+    preview = []
+    num_chunks = 0
+    num_reused = 0
+    batch_texts = []
+    batch_metadatas = []
+    new_texts = []
+    new_metadatas = []
+    moved_ids = []
+    moved_metadatas = []
+    # What a failed re-index has to undo: chunks it added, and the metadata of chunks it moved
+    inserted_ids = []
+    moved_from = []
+    
+    def flush_batch():
+        if batch_texts:
+            if new_texts:
+                with stage_timer.accumulate(timings, 'embed'):
+                    vectors = store.embeddings.embed_documents(new_texts)
+                ids = [str(uuid.uuid4()) for _ in new_texts]
+                inserted_ids.extend(ids)
+                with stage_timer.accumulate(timings, 'vector_write'):
+                    store.upsert(
+                        ids=ids,
+                        embeddings=vectors,
+                        documents=new_texts,
+                        metadatas=new_metadatas
+                    )
+            if moved_ids:
+                # Unchanged text whose position or page shifted keeps its vector; only the metadata is rewritten
+                with stage_timer.accumulate(timings, 'vector_write'):
+                    store.update_metadatas(moved_ids, moved_metadatas)
+            with stage_timer.accumulate(timings, 'lexical_write'):
+                lexical_index.add_chunks(batch_texts, batch_metadatas)
+            invalidate_caches()
+            progress(chunks_embedded=num_chunks, chunks_reused=num_reused)
+            for pending in (batch_texts, batch_metadatas, new_texts, new_metadatas, moved_ids, moved_metadatas):
+                pending.clear()
+    
+    # Text is read, split, embedded and stored in fixed-size batches, so memory stays flat however large the file is
+    sections = stage_timer.iterate(
+        iter_with_preview(iter_document_sections(filepath, ext, progress), preview), timings, 'extract'
     )
+    try:
+        for page, chunk in stage_timer.iterate(iter_document_chunks(sections, text_splitter), timings, 'split'):
+            metadata = chunk_metadata(filename, doc_id, num_chunks, page)
+            batch_texts.append(chunk)
+            batch_metadatas.append(metadata)
+            matches = reusable.get(hash_text(chunk))
+            # A changed set of metadata keys (e.g. a txt revision of a pdf losing "page") can't be patched in place
+            if matches and set(matches[0][1]) == set(metadata):
+                chunk_id, stored_metadata = matches.pop(0)
+                num_reused += 1
+                if stored_metadata != metadata:
+                    moved_ids.append(chunk_id)
+                    moved_metadatas.append(metadata)
+                    moved_from.append((chunk_id, stored_metadata))
+            else:
+                new_texts.append(chunk)
+                new_metadatas.append(metadata)
+            num_chunks += 1
+            if len(batch_texts) >= EMBED_BATCH_SIZE:
+                flush_batch()
+        flush_batch()
+    except Exception:
+        restore_document_chunks(store, doc_id, inserted_ids, moved_from)
+        raise
+    # Chunk timing includes the section reads it pulled through; keep the two stages disjoint
+    timings['split'] -= timings['extract']
     
-    metadatas = [{"source": filename, "doc_id": doc_id, "chunk": i} for i in range(len(chunks))]
-    vectorstore.add_texts(texts=chunks, metadatas=metadatas)
+    stale_ids = [chunk_id for matches in reusable.values() for chunk_id, _ in matches]
+    if stale_ids:
+        with stage_timer.accumulate(timings, 'vector_write'):
+            store.delete(stale_ids)
+    # Questions answered while the document was being re-indexed may cite chunks that have since changed
+    invalidate_caches(doc_id)
     
-    documents_metadata[doc_id] = {
-        "id": doc_id,
-        "filename": filename,
-        "chunks": len(chunks),
-        "filepath": filepath,
-        "folder": folder,
-        "uploaded_at": datetime.now().isoformat(),
-        "text_preview": text[:500] if len(text) > 500 else text
+    with stage_timer.accumulate(timings, 'metadata_write'):
+        document_store.add({
+            "id": doc_id,
+            "filename": filename,
+            "chunks": num_chunks,
+            "filepath": filepath,
+            "folder": folder,
+            "uploaded_at": datetime.now().isoformat(),
+            "text_preview": "".join(preview)
+        })
+    progress(stage='done', chunks_total=num_chunks)
+    
+    stage_timer.record_all('ingest', timings)
+    documents_ingested.inc()
+    bytes_ingested.inc(os.path.getsize(filepath))
+    chunks_ingested.inc(num_chunks - num_reused, result='added')
+    chunks_ingested.inc(num_reused, result='unchanged')
+    chunks_ingested.inc(len(stale_ids), result='removed')
+    
+    return doc_id, num_chunks, {
+        "chunks_added": num_chunks - num_reused,
+        "chunks_unchanged": num_reused,
+        "chunks_removed": len(stale_ids)
+    }
+
+def run_ingest_job(payload, progress):
+    filepath = payload['filepath']
+    try:
+        doc_id, num_chunks, _ = process_document(
+            filepath, payload['filename'], payload.get('folder'),
+            doc_id=payload['doc_id'], progress=progress
+        )
+    except Exception:
+        # Batches stored before the failure have no document row, so nothing else could ever delete them
+        if document_store.get(payload['doc_id']) is None:
+            get_vectorstore().delete_document(payload['doc_id'])
+            lexical_index.delete_document(payload['doc_id'])
+            invalidate_caches(payload['doc_id'])
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    return {
+        "doc_id": doc_id,
+        "filename": payload['filename'],
+        "chunks": num_chunks,
+        "folder": payload.get('folder'),
+        "uploaded_at": document_store.get(doc_id)['uploaded_at']
+    }
+
+def run_reindex_job(payload, progress):
+    filepath = payload['filepath']
+    doc = document_store.get(payload['doc_id'])
+    if doc is None:
+        raise ValueError("Document was deleted before it could be re-indexed")
+    try:
+        doc_id, num_chunks, changes = process_document(
+            filepath, payload['filename'], doc['folder'],
+            doc_id=doc['id'], progress=progress
+        )
+    except Exception:
+        if filepath != doc['filepath'] and os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    if doc['filepath'] != filepath and os.path.exists(doc['filepath']):
+        os.remove(doc['filepath'])
+    return {
+        "doc_id": doc_id,
+        "filename": payload['filename'],
+        "chunks": num_chunks,
+        "folder": doc['folder'],
+        "uploaded_at": document_store.get(doc_id)['uploaded_at'],
+        **changes
+    }
+
+def iter_bulk_inputs(payload):
+    folder = payload.get('folder')
+    for rejected in payload['rejected']:
+        yield {"filename": rejected['filename'], "status": "skipped", "error": rejected['error']}
+    for entry in payload['files']:
+        yield dict(entry, folder=folder)
+    for archive in payload['archives']:
+        extracted_bytes = 0
+        try:
+            for name, size, open_member in iter_archive_members(archive['filepath']):
+                basename = os.path.basename(name)
+                if name.startswith('__MACOSX/') or basename.startswith('.'):
+                    continue
+                filename = secure_filename(basename)
+                if not filename or not allowed_file(filename):
+                    yield {"filename": name, "archive": archive['filename'], "status": "skipped", "error": "File type not allowed"}
+                    continue
+                if size > max_file_size(filename):
+                    yield {"filename": name, "archive": archive['filename'], "status": "skipped", "error": "File too large"}
+                    continue
+                extracted_bytes += size
+                if extracted_bytes > BULK_MAX_EXTRACTED_BYTES:
+                    yield {"filename": name, "archive": archive['filename'], "status": "skipped", "error": "Archive exceeds the extracted size limit; remaining files were not read"}
+                    break
+                # Derived from the batch, so a job resumed after a restart maps each member to the same doc_id
+                doc_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{payload['batch_id']}/{archive['filename']}/{name}"))
+                filepath = os.path.join(UPLOAD_FOLDER, f"{doc_id}_{filename}")
+                with open_member() as source, open(filepath, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                yield {"doc_id": doc_id, "filename": filename, "filepath": filepath, "folder": folder, "archive": archive['filename']}
+        except Exception as e:
+            yield {"filename": archive['filename'], "status": "failed", "error": f"Could not read archive: {str(e)}"}
+
+def extract_bulk_files(entries):
+    text_splitter = build_text_splitter()
+    for entry in entries:
+        if 'status' in entry:
+            yield ('result', entry)
+            continue
+        existing = document_store.get(entry['doc_id'])
+        if existing is not None:
+            yield ('result', dict(entry, status='completed', chunks=existing['chunks']))
+            continue
+        # Chunks left by an interrupted run; vectors use deterministic ids and are simply overwritten
+        lexical_index.delete_document(entry['doc_id'])
+        ext = entry['filename'].rsplit('.', 1)[1].lower()
+        try:
+            preview = []
+            num_chunks = 0
+            texts = []
+            metadatas = []
+            sections = iter_with_preview(iter_document_sections(entry['filepath'], ext), preview)
+            for page, chunk in iter_document_chunks(sections, text_splitter):
+                texts.append(chunk)
+                metadatas.append(chunk_metadata(entry['filename'], entry['doc_id'], num_chunks, page))
+                num_chunks += 1
+                if len(texts) >= BULK_EMBED_BATCH_SIZE:
+                    yield ('chunks', entry, texts, metadatas)
+                    texts, metadatas = [], []
+            if texts:
+                yield ('chunks', entry, texts, metadatas)
+            yield ('done', dict(entry, chunks=num_chunks, text_preview="".join(preview)))
+        except Exception as e:
+            yield ('failed', entry, f"Error processing document: {str(e)}")
+
+def embed_bulk_chunks(embedder):
+    def embed_batch(pending):
+        texts = [text for message in pending if message[0] == 'chunks' for text in message[2]]
+        try:
+            with stage_timer.time('bulk_ingest', 'embed'):
+                vectors = embedder.embed_documents(texts) if texts else []
+        except Exception as e:
+            return [
+                ('failed', message[1], f"Embedding failed: {str(e)}") if message[0] == 'chunks' else message
+                for message in pending
+            ]
+        embedded = []
+        offset = 0
+        for message in pending:
+            if message[0] == 'chunks':
+                count = len(message[2])
+                embedded.append(('vectors', message[1], message[2], message[3], vectors[offset:offset + count]))
+                offset += count
+            else:
+                embedded.append(message)
+        return embedded
+
+    def handler(messages):
+        # Chunks from many documents are embedded together; other messages keep their place in the stream
+        # so a document's "done" never overtakes its last chunks
+        pending = []
+        pending_texts = 0
+        for message in messages:
+            pending.append(message)
+            if message[0] == 'chunks':
+                pending_texts += len(message[2])
+            if pending_texts >= BULK_EMBED_BATCH_SIZE:
+                yield from embed_batch(pending)
+                pending = []
+                pending_texts = 0
+        if pending:
+            yield from embed_batch(pending)
+    return handler
+
+def store_bulk_chunks(store, progress):
+    def handler(messages):
+        failed_docs = set()
+        rows = []
+        counts = {"completed": 0, "failed": 0, "skipped": 0, "chunks": 0}
+        last_report = 0
+        
+        def flush_rows():
+            if rows:
+                with stage_timer.time('bulk_ingest', 'metadata_write'):
+                    document_store.add_many(rows)
+                rows.clear()
+        
+        def result(entry, **fields):
+            nonlocal last_report
+            outcome = {key: entry[key] for key in ('filename', 'doc_id', 'archive', 'status', 'error', 'chunks') if key in entry}
+            outcome.update(fields)
+            counts[outcome['status']] += 1
+            if time.monotonic() - last_report > 0.5:
+                last_report = time.monotonic()
+                progress(files_completed=counts['completed'], files_failed=counts['failed'],
+                         files_skipped=counts['skipped'], chunks_embedded=counts['chunks'])
+            return outcome
+        
+        for message in messages:
+            kind, entry = message[0], message[1]
+            if kind == 'result':
+                yield result(entry)
+                continue
+            doc_id = entry['doc_id']
+            if doc_id in failed_docs:
+                continue
+            if kind == 'vectors':
+                texts, metadatas, vectors = message[2], message[3], message[4]
+                try:
+                    with stage_timer.time('bulk_ingest', 'vector_write'):
+                        store.upsert(
+                            ids=[f"{doc_id}:{metadata['chunk']}" for metadata in metadatas],
+                            embeddings=vectors,
+                            documents=texts,
+                            metadatas=metadatas
+                        )
+                    with stage_timer.time('bulk_ingest', 'lexical_write'):
+                        lexical_index.add_chunks(texts, metadatas)
+                    invalidate_caches()
+                    counts['chunks'] += len(texts)
+                    continue
+                except Exception as e:
+                    kind, message = 'failed', ('failed', entry, f"Error storing chunks: {str(e)}")
+            if kind == 'failed':
+                failed_docs.add(doc_id)
+                store.delete_document(doc_id)
+                lexical_index.delete_document(doc_id)
+                invalidate_caches(doc_id)
+                if os.path.exists(entry['filepath']):
+                    os.remove(entry['filepath'])
+                yield result(entry, status='failed', error=message[2])
+            elif kind == 'done':
+                rows.append({
+                    "id": doc_id,
+                    "filename": entry['filename'],
+                    "chunks": entry['chunks'],
+                    "filepath": entry['filepath'],
+                    "folder": entry['folder'],
+                    "uploaded_at": datetime.now().isoformat(),
+                    "text_preview": entry['text_preview']
+                })
+                documents_ingested.inc()
+                bytes_ingested.inc(os.path.getsize(entry['filepath']))
+                chunks_ingested.inc(entry['chunks'], result='added')
+                if len(rows) >= BULK_METADATA_BATCH_SIZE:
+                    flush_rows()
+                yield result(entry, status='completed')
+        flush_rows()
+        progress(files_completed=counts['completed'], files_failed=counts['failed'],
+                 files_skipped=counts['skipped'], chunks_embedded=counts['chunks'])
+    return handler
+
+def run_bulk_ingest_job(payload, progress):
+    is_connected, error = check_ollama_connection()
+    if not is_connected:
+        raise ConnectionError(f"Cannot connect to Ollama: {error}. Make sure Ollama is running at {model_config['ollama_base_url']}")
+    
+    store = get_vectorstore()
+    progress(stage='processing', files_completed=0, files_failed=0, files_skipped=0, chunks_embedded=0)
+    # Extraction, embedding and vector writes run concurrently, connected by bounded queues
+    pipeline = Pipeline(queue_size=BULK_QUEUE_SIZE)
+    pipeline.add_stage('extract', extract_bulk_files, workers=BULK_EXTRACT_WORKERS)
+    pipeline.add_stage('embed', embed_bulk_chunks(store.embeddings))
+    pipeline.add_stage('store', store_bulk_chunks(store, progress))
+    files = pipeline.run(iter_bulk_inputs(payload))
+    
+    for archive in payload['archives']:
+        if os.path.exists(archive['filepath']):
+            os.remove(archive['filepath'])
+    progress(stage='done')
+    return {
+        "batch_id": payload['batch_id'],
+        "completed": sum(1 for f in files if f['status'] == 'completed'),
+        "failed": sum(1 for f in files if f['status'] == 'failed'),
+        "skipped": sum(1 for f in files if f['status'] == 'skipped'),
+        "chunks": sum(f.get('chunks', 0) for f in files if f['status'] == 'completed'),
+        "files": files
     }
+
+def run_lexical_backfill_job(payload, progress):
+    indexed = 0
+    cursor = None
+    while True:
+        docs, cursor = document_store.list(limit=500, cursor=cursor)
+        for doc in docs:
+            lexical_index.delete_document(doc['id'])
+            stored = get_vectorstore().get(doc['id'])
+            if stored['documents']:
+                lexical_index.add_chunks(stored['documents'], stored['metadatas'])
+                indexed += len(stored['documents'])
+            progress(chunks_indexed=indexed)
+        if cursor is None:
+            break
+    invalidate_caches()
+    return {"chunks_indexed": indexed}
+
+def sync_shadow_document(live, shadow, doc_id):
+    # Makes the shadow collection's copy of a document match the live one. Only text that is missing or
+    # different in the shadow is embedded, so resuming or repeating a pass costs little
+    shadow_chunks = {}
+    offset = 0
+    while True:
+        page = shadow.get(doc_id, limit=EXISTING_CHUNKS_PAGE_SIZE, offset=offset)
+        for chunk_id, text, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            shadow_chunks[chunk_id] = (hash_text(text), metadata)
+        if len(page['ids']) < EXISTING_CHUNKS_PAGE_SIZE:
+            break
+        offset += EXISTING_CHUNKS_PAGE_SIZE
+    
+    embedded = 0
+    offset = 0
+    while True:
+        page = live.get(doc_id, limit=EMBED_BATCH_SIZE, offset=offset)
+        changed = []
+        moved_ids = []
+        moved_metadatas = []
+        for chunk_id, text, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            text_hash, shadow_metadata = shadow_chunks.pop(chunk_id, (None, None))
+            if text_hash != hash_text(text):
+                changed.append((chunk_id, text, metadata))
+            elif shadow_metadata != metadata:
+                moved_ids.append(chunk_id)
+                moved_metadatas.append(metadata)
+        if changed:
+            ids, texts, metadatas = (list(column) for column in zip(*changed))
+            shadow.upsert(ids, shadow.embeddings.embed_documents(texts), texts, metadatas)
+            embedded += len(changed)
+        if moved_ids:
+            shadow.update_metadatas(moved_ids, moved_metadatas)
+        if len(page['ids']) < EMBED_BATCH_SIZE:
+            break
+        offset += EMBED_BATCH_SIZE
     
-    save_metadata()
+    if shadow_chunks:
+        shadow.delete(list(shadow_chunks))
+    return embedded
+
+def update_retired_collections(change):
+    # Compare-and-set retry around the shared list of collections waiting to be dropped
+    while True:
+        retired, version = shared_state.get_setting('retired_collections')
+        if shared_state.save_setting('retired_collections', change(retired or []), version) is not None:
+            return
+
+def retire_collection(collection):
+    # Workers that opened the store before the configuration changed may still be using the collection for a
+    # moment, so it is dropped after a grace period. The drop is saved first: if the job runner restarts
+    # before it happens, the next runner does it
+    entry = {
+        "collection": collection,
+        "vector_backend": model_config.get('vector_backend', 'chroma'),
+        "drop_after": time.time() + MIGRATION_DROP_GRACE_SECONDS
+    }
+    update_retired_collections(
+        lambda retired: retired if any(other['collection'] == collection for other in retired) else retired + [entry]
+    )
+    schedule_collection_drop(entry)
+
+def schedule_collection_drop(entry):
+    # A timer rather than a sleep, so the job worker is free for queued uploads in the meantime
+    timer = threading.Timer(max(entry['drop_after'] - time.time(), 0), drop_retired_collection, args=(entry,))
+    timer.daemon = True
+    timer.start()
+
+def drop_retired_collection(entry):
+    sync_shared_state()
+    in_use = {model_config.get('vector_collection', DEFAULT_VECTOR_COLLECTION)}
+    if model_config.get('embedding_migration') is not None:
+        in_use.add(model_config['embedding_migration']['collection'])
+    if entry['collection'] not in in_use:
+        open_vector_collection(entry['collection'], None, backend=entry['vector_backend']).drop()
+    # Left in place if the drop failed, so the next job runner retries it
+    update_retired_collections(lambda retired: [other for other in retired if other != entry])
+
+def run_embedding_migration_job(payload, progress):
+    def check_cancelled():
+        # A migration can be cancelled from any worker; stop at the next document
+        sync_shared_state()
+        current = model_config.get('embedding_migration')
+        if current is None or current['id'] != payload['migration_id']:
+            progress(stage='cancelled')
+            retire_collection(payload['collection'])
+            raise ValueError("Embedding migration was cancelled")
     
-    return doc_id, len(chunks)
+    if model_config.get('vector_collection', DEFAULT_VECTOR_COLLECTION) == payload['collection']:
+        # Restarted after cutover: only the cleanup is left
+        migration = None
+    else:
+        check_cancelled()
+        migration = model_config['embedding_migration']
+    
+    counts = {"documents": document_store.count(), "chunks_embedded": 0}
+    if migration is not None:
+        store = get_vectorstore()
+        live, shadow = store.live, store.shadow
+        # Two passes: the copy, then a check that catches writes made only to the live collection by
+        # jobs that were already running when the migration started
+        for stage in ('copying', 'verifying'):
+            if stage == 'verifying':
+                progress(stage='waiting_for_jobs')
+                while any(
+                    job['status'] == 'running' and job['kind'] != 'embedding_migration'
+                    and job['created_at'] < migration['started_at']
+                    for job in job_queue.store.pending()
+                ):
+                    time.sleep(1)
+            progress(stage=stage, documents_total=document_store.count(), documents_done=0,
+                     chunks_embedded=counts['chunks_embedded'])
+            done = 0
+            cursor = None
+            while True:
+                docs, cursor = document_store.list(limit=500, cursor=cursor)
+                for doc in docs:
+                    check_cancelled()
+                    counts['chunks_embedded'] += sync_shadow_document(live, shadow, doc['id'])
+                    done += 1
+                    progress(documents_done=done, chunks_embedded=counts['chunks_embedded'])
+                if cursor is None:
+                    break
+        # Documents deleted through a store handle opened before the migration started
+        _, changed_doc_ids, _ = shared_state.changes_since(migration['changes_from'])
+        for doc_id in changed_doc_ids - {None}:
+            if document_store.get(doc_id) is None:
+                shadow.delete_document(doc_id)
+        
+        progress(stage='cutover')
+        # One compare-and-set of the shared configuration switches every worker to the new collection
+        while True:
+            config = dict(model_config)
+            config['embedding_model'] = migration['embedding_model']
+            config['vector_collection'] = migration['collection']
+            del config['embedding_migration']
+            version = shared_state.save_setting('model_config', config, config_version)
+            if version is not None:
+                break
+            check_cancelled()
+        apply_model_config(config, version)
+        invalidate_caches()
+    
+    retire_collection(payload['previous_collection'])
+    progress(stage='done')
+    return {
+        "embedding_model": payload['embedding_model'],
+        "collection": payload['collection'],
+        "documents": counts['documents'],
+        "chunks_embedded": counts['chunks_embedded']
+    }
+
+def start_job_runner():
+    # Runs only in the process holding the job runner lock, so worker processes starting together don't
+    # each queue a backfill. Documents ingested before the lexical index existed are indexed from the chunks
+    # already in the vector store
+    if lexical_index.count() == 0 and document_store.count() and not job_queue.store.pending('lexical_backfill'):
+        job_queue.submit('lexical_backfill', {})
+    # Collections a previous runner retired but exited before dropping
+    retired, _ = shared_state.get_setting('retired_collections')
+    for entry in retired or []:
+        schedule_collection_drop(entry)
+
+def create_app():
+    # Opens the stores and loads saved state, once per process. Run by `python app.py`, or as the WSGI
+    # entry point (gunicorn 'app:create_app()'); the first request also calls it, as a fallback
+    global embedding_cache, document_store, conversation_store, lexical_index, job_queue, shared_state, app_initialized
+    with init_lock:
+        if app_initialized:
+            return app
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        os.makedirs(CHROMA_PATH, exist_ok=True)
+        embedding_cache = EmbeddingCache(EMBEDDING_CACHE_FILE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+        document_store = DocumentStore(DOCUMENTS_DB_FILE)
+        conversation_store = ConversationStore(CONVERSATIONS_DB_FILE)
+        lexical_index = LexicalIndex(LEXICAL_INDEX_FILE)
+        job_queue = JobQueue(JobStore(JOBS_DB_FILE), max_workers=INGEST_WORKERS, lock_path=JOB_RUNNER_LOCK_FILE)
+        shared_state = SharedStateStore(SHARED_STATE_DB_FILE)
+        
+        load_metadata()
+        load_conversations()
+        load_model_config()
+        
+        job_queue.before_run = sync_shared_state
+        job_queue.on_runner_start = start_job_runner
+        job_queue.register('ingest', run_ingest_job)
+        job_queue.register('reindex', run_reindex_job)
+        job_queue.register('bulk_ingest', run_bulk_ingest_job)
+        job_queue.register('lexical_backfill', run_lexical_backfill_job)
+        job_queue.register('embedding_migration', run_embedding_migration_job)
+        app_initialized = True
+    return app
+
+def run_warmup():
+    started = time.perf_counter()
+    try:
+        get_vectorstore()
+        build_text_splitter()
+        load_parsers()
+        # Creating the client is what imports the ollama package
+        ollama_service.client
+        warmup['state'] = 'done'
+    except Exception as e:
+        warmup['error'] = str(e)
+        warmup['state'] = 'failed'
+        print(f"Warm-up failed: {e}")
+    startup_seconds.set(time.perf_counter() - started, phase='warmup')
+
+def start_warmup():
+    with init_lock:
+        if warmup['thread'] is None:
+            warmup['state'] = 'running'
+            warmup['thread'] = threading.Thread(target=run_warmup, name='warmup', daemon=True)
+            warmup['thread'].start()
+
+@app.before_request
+def start_background_workers():
+    create_app()
+    sync_shared_state()
+    job_queue.start()
+    ollama_service.start_probe()
+    if WARMUP_ON_START:
+        start_warmup()
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.timings = stage_timer.collect() if request.headers.get(DEBUG_TIMINGS_HEADER) else None
+
+@app.after_request
+def record_request_timing(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_request_duration.observe(
+        time.perf_counter() - g.request_started,
+        method=request.method, endpoint=endpoint, status=response.status_code
+    )
+    if g.timings is not None:
+        stage_timer.stop_collecting()
+        totals = summarize_timings(g.timings)
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={milliseconds}" for name, milliseconds in totals.items()
+        )
+        if response.is_json and not response.is_streamed:
+            data = response.get_json()
+            if isinstance(data, dict):
+                data['timings'] = totals
+                response.set_data(json.dumps(data))
+    return response
+
+def summarize_timings(timings):
+    totals = defaultdict(float)
+    for name, seconds in timings:
+        totals[name] += seconds
+    return {name: round(seconds * 1000, 2) for name, seconds in totals.items()}
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health', methods=['GET'])
 def health():
+    # Liveness only: answers as soon as the process can serve requests, before anything heavy is loaded
     return jsonify({"status": "healthy"})
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness: with warm-up enabled, not ready until the vector store, splitter and parsers are loaded
+    is_ready = warmup['state'] == 'done' or not WARMUP_ON_START
+    ollama_available, _ = check_ollama_connection()
+    body = {
+        "status": "ready" if is_ready else "starting",
+        "warmup": warmup['state'] if WARMUP_ON_START else "disabled",
+        "startup_seconds": {
+            phase: round(seconds, 3) for (phase,), seconds in startup_seconds.values().items()
+        },
+        "ollama_available": ollama_available
+    }
+    if warmup['error']:
+        body['error'] = warmup['error']
+    return jsonify(body), 200 if is_ready else 503
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "embeddings": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "answers": answer_cache.stats()
+    }), 200
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    # The per-type limit is only known once the filename is parsed, so the body limit is the largest one
+    request.max_content_length = TXT_MAX_CONTENT_LENGTH
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     
@@ -194,33 +1069,264 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        doc_id = str(uuid.uuid4())
+        # Prefixed so an upload doesn't overwrite another file with the same name before its job runs
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{doc_id}_{filename}")
         file.save(filepath)
+        if discard_if_oversized(filepath, filename):
+            return jsonify({"error": "File too large"}), 413
         
-        try:
-            doc_id, num_chunks = process_document(filepath, filename, folder)
-            doc_data = documents_metadata[doc_id]
-            return jsonify({
-                "message": "File uploaded and processed successfully",
-                "doc_id": doc_id,
-                "filename": filename,
-                "chunks": num_chunks,
-                "folder": folder,
-                "uploaded_at": doc_data['uploaded_at']
-            }), 200
-        except ConnectionError as e:
-            os.remove(filepath)
-            return jsonify({
-                "error": str(e),
-                "error_type": "ollama_connection"
-            }), 503
-        except Exception as e:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+        job = job_queue.submit('ingest', {
+            "filepath": filepath,
+            "filename": filename,
+            "folder": folder,
+            "doc_id": doc_id
+        })
+        return jsonify({
+            "message": "File uploaded, processing queued",
+            "job_id": job['id'],
+            "doc_id": doc_id,
+            "filename": filename,
+            "folder": folder,
+            "status": job['status']
+        }), 202
     
     return jsonify({"error": "File type not allowed. Supported formats: PDF, DOCX, TXT"}), 400
 
+@app.route('/upload/bulk', methods=['POST'])
+def upload_bulk():
+    request.max_content_length = BULK_MAX_CONTENT_LENGTH
+    uploads = [upload for upload in request.files.getlist('files') if upload.filename]
+    folder = request.form.get('folder', None)
+    
+    if not uploads:
+        return jsonify({"error": "No files provided"}), 400
+    
+    batch_id = str(uuid.uuid4())
+    files = []
+    archives = []
+    rejected = []
+    for upload in uploads:
+        filename = secure_filename(upload.filename)
+        # Stored names are prefixed so files with the same name in one batch (or across batches) don't overwrite each other
+        if filename and is_archive(filename):
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{batch_id}_{filename}")
+            upload.save(filepath)
+            archives.append({"filename": filename, "filepath": filepath})
+        elif filename and allowed_file(filename):
+            doc_id = str(uuid.uuid4())
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{doc_id}_{filename}")
+            upload.save(filepath)
+            if discard_if_oversized(filepath, filename):
+                rejected.append({"filename": upload.filename, "error": "File too large"})
+                continue
+            files.append({"doc_id": doc_id, "filename": filename, "filepath": filepath})
+        else:
+            rejected.append({"filename": upload.filename, "error": "File type not allowed"})
+    
+    job = job_queue.submit('bulk_ingest', {
+        "batch_id": batch_id,
+        "folder": folder,
+        "files": files,
+        "archives": archives,
+        "rejected": rejected
+    })
+    return jsonify({
+        "message": "Files uploaded, processing queued",
+        "job_id": job['id'],
+        "batch_id": batch_id,
+        "files": len(files),
+        "archives": len(archives),
+        "rejected": rejected,
+        "folder": folder,
+        "status": job['status']
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job.pop('payload', None)
+    return jsonify(job), 200
+
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the uploaded documents to answer your question."
+
+def ollama_unavailable_message(error):
+    return f"Cannot connect to Ollama: {error}. Make sure Ollama is running at {model_config['ollama_base_url']} with the configured models ({model_config['embedding_model']}, {model_config['llm_model']}) installed."
+
+def resolve_scope(data):
+    folder = data.get('folder') or None
+    doc_ids = data.get('doc_ids')
+    if folder is not None and doc_ids is not None:
+        raise ValueError("Specify either folder or doc_ids, not both")
+    if folder is not None:
+        if not isinstance(folder, str):
+            raise ValueError("folder must be a string")
+        return document_store.ids_in_folder(folder)
+    if doc_ids is not None:
+        if not isinstance(doc_ids, list) or not all(isinstance(doc_id, str) for doc_id in doc_ids):
+            raise ValueError("doc_ids must be a list of document ids")
+        return list(dict.fromkeys(doc_ids))
+    return None
+
+def retrieve_relevant_docs_batch(questions, k=3, doc_ids=None):
+    # doc_ids=None searches every document; a list restricts both the vector and the lexical search to those documents
+    timings = defaultdict(float)
+    try:
+        if doc_ids is not None and not doc_ids:
+            return [[] for _ in questions]
+        model = model_config['embedding_model']
+        scope = frozenset(doc_ids) if doc_ids is not None else None
+        results = [None] * len(questions)
+        result_keys = [retrieval_cache.result_key(model, question, k, scope) for question in questions]
+        needs_vector_search = []
+    
+        for i, question in enumerate(questions):
+            with stage_timer.accumulate(timings, 'result_cache'):
+                results[i] = retrieval_cache.results.get(result_keys[i])
+            if results[i] is not None:
+                continue
+            # Part numbers, clause numbers and similar lookups are answered from the lexical index without an
+            # embedding call, as long as the identifier itself occurs; otherwise they go through hybrid search
+            if is_keyword_query(question):
+                with stage_timer.accumulate(timings, 'lexical_search'):
+                    results[i] = lexical_index.search(
+                        question, k=k, doc_ids=doc_ids, required_terms=identifier_terms(question)
+                    ) or None
+                if results[i] is not None:
+                    retrieval_cache.results.put(result_keys[i], results[i])
+                    continue
+            needs_vector_search.append(i)
+    
+        if not needs_vector_search:
+            return results
+    
+        embedding_keys = {i: (model, normalize_question(questions[i])) for i in needs_vector_search}
+        query_embeddings = {i: retrieval_cache.query_embeddings.get(embedding_keys[i]) for i in needs_vector_search}
+        to_embed = [i for i in needs_vector_search if query_embeddings[i] is None]
+        if to_embed:
+            with stage_timer.accumulate(timings, 'embed_query'):
+                vectors = embeddings.embed_queries([questions[i] for i in to_embed])
+            for i, vector in zip(to_embed, vectors):
+                query_embeddings[i] = vector
+                retrieval_cache.query_embeddings.put(embedding_keys[i], vector)
+    
+        # One query call searches for every question at once; a scope becomes a metadata pre-filter,
+        # so only the scoped documents' vectors are candidates
+        with stage_timer.accumulate(timings, 'vector_search'):
+            response = get_vectorstore().query(
+                [query_embeddings[i] for i in needs_vector_search], k * 2, doc_ids=doc_ids
+            )
+        for row, i in enumerate(needs_vector_search):
+            vector_docs = [
+                Document(page_content=text, metadata=metadata)
+                for text, metadata in zip(response['documents'][row], response['metadatas'][row])
+            ]
+            with stage_timer.accumulate(timings, 'lexical_search'):
+                lexical_docs = lexical_index.search(questions[i], k=k * 2, doc_ids=doc_ids)
+            with stage_timer.accumulate(timings, 'fusion'):
+                results[i] = reciprocal_rank_fusion([vector_docs, lexical_docs], k)
+            retrieval_cache.results.put(result_keys[i], results[i])
+        return results
+    finally:
+        stage_timer.record_all('retrieve', timings)
+
+def retrieve_relevant_docs(question, k=3, doc_ids=None):
+    return retrieve_relevant_docs_batch([question], k=k, doc_ids=doc_ids)[0]
+
+def context_token_budget(llm_model):
+    # Per-model budgets, e.g. {"llama3.2": 3000}; a tagged name ("llama3.2:3b") falls back to its base name
+    budgets = model_config.get('context_token_budgets') or {}
+    return budgets.get(llm_model) or budgets.get(llm_model.split(':')[0]) or DEFAULT_CONTEXT_TOKEN_BUDGET
+
+def select_context(relevant_docs, llm_model):
+    # Returns (merged passages for the prompt, the chunks actually used, for the sources list)
+    with stage_timer.time('ask', 'pack_context'):
+        passages, used_docs = pack_context(relevant_docs, context_token_budget(llm_model))
+    retrieved_tokens = sum(estimate_tokens(doc.page_content) for doc in relevant_docs)
+    used_tokens = sum(estimate_tokens(doc.page_content) for doc in used_docs)
+    packed_tokens = sum(estimate_tokens(passage.page_content) for passage in passages)
+    context_tokens.inc(packed_tokens, result='packed')
+    context_tokens.inc(max(used_tokens - packed_tokens, 0), result='deduplicated')
+    context_tokens.inc(retrieved_tokens - used_tokens, result='dropped')
+    context_chunks.observe(len(used_docs))
+    return passages, used_docs
+
+def cached_answer(question, used_docs, llm_model):
+    # Returns (cached {"answer", "sources"} or None, the key to store a fresh answer under). A rephrased
+    # question only reuses an answer when it retrieved exactly the same chunks for the same models
+    with stage_timer.time('ask', 'answer_cache'):
+        embedding_model = model_config['embedding_model']
+        embedding_key = (embedding_model, normalize_question(question))
+        vector = retrieval_cache.query_embeddings.get(embedding_key)
+        if vector is None and is_keyword_query(question):
+            # Keyword questions are answered from the lexical index without an embedding; rather than adding
+            # an Ollama call back, their answers are only reused for the same normalized question
+            cache_key = ((embedding_model, llm_model, embedding_key[1]), source_signature(used_docs), None)
+        else:
+            if vector is None:
+                vector = embeddings.embed_queries([question])[0]
+                retrieval_cache.query_embeddings.put(embedding_key, vector)
+            cache_key = ((embedding_model, llm_model), source_signature(used_docs), vector)
+        threshold = model_config.get('answer_cache_threshold', DEFAULT_ANSWER_CACHE_THRESHOLD)
+        return answer_cache.get(*cache_key, threshold), cache_key
+
+def store_answer(cache_key, answer, generation):
+    # A delete or re-index in another worker only reaches this one's cache through the change log
+    sync_shared_state()
+    answer_cache.put(*cache_key, answer, generation=generation)
+
+def generate_tokens(prompt, llm_model, priority='interactive'):
+    # Waits for a free slot in the LLM scheduler; a request for a prompt that is already queued or running
+    # shares that generation instead of starting another one
+    service = ollama_service
+    
+    def produce():
+        for part in service.generate_stream(model=llm_model, prompt=prompt):
+            if part['response']:
+                yield part['response']
+    
+    return llm_scheduler.stream((llm_model, prompt), produce, priority)
+
+def llm_busy_response(error):
+    return jsonify({"error": str(error), "error_type": "llm_busy"}), 503, {'Retry-After': '5'}
+
+def build_prompt(question, relevant_docs):
+    context = "\n\n".join([doc.page_content for doc in relevant_docs])
+    
+    prompt = f"""Based on the following context from the uploaded documents, please answer the question. If the answer cannot be found in the context, say so.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer:"""
+    prompt_size.observe(len(prompt))
+    return prompt
+
+def build_sources(relevant_docs):
+    sources = []
+    for doc in relevant_docs:
+        sources.append({
+            "source": doc.metadata.get('source', 'Unknown'),
+            "chunk": doc.metadata.get('chunk', 0),
+            "page": doc.metadata.get('page'),
+            "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
+        })
+    return sources
+
+def save_qa_entry(conversation_id, question, answer, sources):
+    qa_entry = {
+        "question": question,
+        "answer": answer,
+        "sources": sources,
+        "timestamp": datetime.now().isoformat()
+    }
+    
+    return conversation_store.add_message(conversation_id, qa_entry)
+
 @app.route('/ask', methods=['POST'])
 def ask_question():
     data = request.json
@@ -230,128 +1336,322 @@ def ask_question():
     if not question:
         return jsonify({"error": "No question provided"}), 400
     
+    try:
+        doc_ids = resolve_scope(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     try:
         is_connected, error = check_ollama_connection()
         if not is_connected:
             return jsonify({
-                "error": f"Cannot connect to Ollama: {error}. Make sure Ollama is running at {model_config['ollama_base_url']} with the configured models ({model_config['embedding_model']}, {model_config['llm_model']}) installed.",
+                "error": ollama_unavailable_message(error),
                 "error_type": "ollama_connection"
             }), 503
         
-        vectorstore = Chroma(
-            client=chroma_client,
-            collection_name="documents",
-            embedding_function=embeddings
-        )
-        
-        relevant_docs = vectorstore.similarity_search(question, k=3)
+        cache_generation = answer_cache.generation
+        relevant_docs = retrieve_relevant_docs(question, k=CONTEXT_CANDIDATES, doc_ids=doc_ids)
         
         if not relevant_docs:
             return jsonify({
-                "answer": "I couldn't find any relevant information in the uploaded documents to answer your question.",
+                "answer": NO_CONTEXT_ANSWER,
                 "sources": []
             }), 200
         
-        context = "\n\n".join([doc.page_content for doc in relevant_docs])
+        llm_model = model_config['llm_model']
+        passages, used_docs = select_context(relevant_docs, llm_model)
+        cached, cache_key = cached_answer(question, used_docs, llm_model)
+        if cached is not None:
+            answer, sources = cached['answer'], cached['sources']
+        else:
+            prompt = build_prompt(question, passages)
+            with stage_timer.time('ask', 'generate'):
+                answer = "".join(generate_tokens(prompt, llm_model))
+            
+            sources = build_sources(used_docs)
+            store_answer(cache_key, {"answer": answer, "sources": sources}, cache_generation)
+        with stage_timer.time('ask', 'save_conversation'):
+            conversation_id = save_qa_entry(conversation_id, question, answer, sources)
         
-        prompt = f"""Based on the following context from the uploaded documents, please answer the question. If the answer cannot be found in the context, say so.
-
-Context:
-{context}
+        return jsonify({
+            "answer": answer,
+            "sources": sources,
+            "conversation_id": conversation_id,
+            "cached": cached is not None
+        }), 200
+        
+    except SchedulerBusy as e:
+        return llm_busy_response(e)
+    except ConnectionError as e:
+        return jsonify({
+            "error": ollama_unavailable_message(e),
+            "error_type": "ollama_connection"
+        }), 503
+    except Exception as e:
+        return jsonify({"error": f"Error processing question: {str(e)}"}), 500
 
-Question: {question}
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-Answer:"""
-        
-        response = ollama.generate(
-            model=model_config['llm_model'],
-            prompt=prompt,
-            host=model_config['ollama_base_url']
-        )
-        
-        answer = response['response']
+@app.route('/ask/stream', methods=['POST'])
+def ask_question_stream():
+    data = request.json
+    question = data.get('question', '')
+    conversation_id = data.get('conversation_id', None)
+    
+    if not question:
+        return jsonify({"error": "No question provided"}), 400
+    
+    try:
+        doc_ids = resolve_scope(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        is_connected, error = check_ollama_connection()
+        if not is_connected:
+            return jsonify({
+                "error": ollama_unavailable_message(error),
+                "error_type": "ollama_connection"
+            }), 503
         
-        sources = []
-        for doc in relevant_docs:
-            sources.append({
-                "source": doc.metadata.get('source', 'Unknown'),
-                "chunk": doc.metadata.get('chunk', 0),
-                "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-            })
+        cache_generation = answer_cache.generation
+        relevant_docs = retrieve_relevant_docs(question, k=CONTEXT_CANDIDATES, doc_ids=doc_ids)
+    except ConnectionError as e:
+        return jsonify({
+            "error": ollama_unavailable_message(e),
+            "error_type": "ollama_connection"
+        }), 503
+    except Exception as e:
+        return jsonify({"error": f"Error processing question: {str(e)}"}), 500
+    
+    llm_model = model_config['llm_model']
+    timings = g.timings
+    
+    def generate():
+        if timings is not None:
+            # Headers (and Server-Timing) are already sent, so streamed timings ride on the done event instead
+            stage_timer.collect(timings)
+        try:
+            yield from stream_answer()
+        finally:
+            if timings is not None:
+                stage_timer.stop_collecting()
+    
+    def done_event(answer, saved_id, cached=False):
+        data = {"answer": answer, "conversation_id": saved_id, "cached": cached}
+        if timings is not None:
+            data['timings'] = summarize_timings(timings)
+        return sse_event('done', data)
+    
+    def stream_answer():
+        if not relevant_docs:
+            yield sse_event('sources', {"sources": []})
+            yield sse_event('token', {"token": NO_CONTEXT_ANSWER})
+            yield done_event(NO_CONTEXT_ANSWER, None)
+            return
         
-        qa_entry = {
-            "question": question,
-            "answer": answer,
-            "sources": sources,
-            "timestamp": datetime.now().isoformat()
-        }
+        passages, used_docs = select_context(relevant_docs, llm_model)
+        try:
+            cached, cache_key = cached_answer(question, used_docs, llm_model)
+        except ConnectionError as e:
+            yield sse_event('error', {"error": ollama_unavailable_message(e), "error_type": "ollama_connection"})
+            return
+        if cached is not None:
+            # A cached answer is sent as a single token so clients need no separate code path
+            yield sse_event('sources', {"sources": cached['sources']})
+            yield sse_event('token', {"token": cached['answer']})
+            with stage_timer.time('ask', 'save_conversation'):
+                saved_id = save_qa_entry(conversation_id, question, cached['answer'], cached['sources'])
+            yield done_event(cached['answer'], saved_id, cached=True)
+            return
         
-        if conversation_id:
-            for conv in conversations:
-                if conv['id'] == conversation_id:
-                    conv['messages'].append(qa_entry)
-                    conv['updated_at'] = datetime.now().isoformat()
-                    break
-        else:
-            conversation_id = str(uuid.uuid4())
-            conversations.append({
-                "id": conversation_id,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat(),
-                "messages": [qa_entry]
-            })
+        sources = build_sources(used_docs)
+        yield sse_event('sources', {"sources": sources})
         
-        save_conversations()
+        try:
+            tokens = []
+            started = time.perf_counter()
+            for token in generate_tokens(build_prompt(question, passages), llm_model):
+                if not tokens:
+                    stage_timer.record('ask', 'first_token', time.perf_counter() - started)
+                tokens.append(token)
+                yield sse_event('token', {"token": token})
+            stage_timer.record('ask', 'generate', time.perf_counter() - started)
+            
+            # Persist only after a complete answer; a client disconnect stops the generator before this point
+            answer = "".join(tokens)
+            store_answer(cache_key, {"answer": answer, "sources": sources}, cache_generation)
+            with stage_timer.time('ask', 'save_conversation'):
+                saved_id = save_qa_entry(conversation_id, question, answer, sources)
+            yield done_event(answer, saved_id)
+        except SchedulerBusy as e:
+            yield sse_event('error', {"error": str(e), "error_type": "llm_busy"})
+        except ConnectionError as e:
+            yield sse_event('error', {"error": ollama_unavailable_message(e), "error_type": "ollama_connection"})
+        except Exception as e:
+            yield sse_event('error', {"error": f"Error processing question: {str(e)}"})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_questions_batch():
+    data = request.json or {}
+    questions = data.get('questions', [])
+    
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({"error": "questions must be a non-empty list of non-empty strings"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}), 400
+    
+    try:
+        doc_ids = resolve_scope(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        is_connected, error = check_ollama_connection()
+        if not is_connected:
+            return jsonify({
+                "error": ollama_unavailable_message(error),
+                "error_type": "ollama_connection"
+            }), 503
         
+        cache_generation = answer_cache.generation
+        relevant_docs_list = retrieve_relevant_docs_batch(questions, k=CONTEXT_CANDIDATES, doc_ids=doc_ids)
+    except ConnectionError as e:
         return jsonify({
-            "answer": answer,
-            "sources": sources,
-            "conversation_id": conversation_id
-        }), 200
-        
+            "error": ollama_unavailable_message(e),
+            "error_type": "ollama_connection"
+        }), 503
     except Exception as e:
-        return jsonify({"error": f"Error processing question: {str(e)}"}), 500
+        return jsonify({"error": f"Error processing questions: {str(e)}"}), 500
+    
+    llm_model = model_config['llm_model']
+    
+    def answer(index):
+        question = questions[index]
+        relevant_docs = relevant_docs_list[index]
+        if not relevant_docs:
+            return {"index": index, "question": question, "answer": NO_CONTEXT_ANSWER, "sources": []}
+        passages, used_docs = select_context(relevant_docs, llm_model)
+        cached, cache_key = cached_answer(question, used_docs, llm_model)
+        if cached is not None:
+            return {"index": index, "question": question, **cached, "cached": True}
+        prompt = build_prompt(question, passages)
+        with stage_timer.time('ask', 'generate'):
+            # Batch questions queue behind interactive ones
+            answer = "".join(generate_tokens(prompt, llm_model, priority='batch'))
+        result = {"answer": answer, "sources": build_sources(used_docs)}
+        store_answer(cache_key, result, cache_generation)
+        return {"index": index, "question": question, **result, "cached": False}
+    
+    def generate():
+        # Results are written as each generation finishes, so lines arrive out of order; use "index" to match them up
+        with ThreadPoolExecutor(max_workers=BATCH_GENERATION_CONCURRENCY) as pool:
+            futures = {pool.submit(answer, i): i for i in range(len(questions))}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except SchedulerBusy as e:
+                        index = futures[future]
+                        result = {"index": index, "question": questions[index], "error": str(e), "error_type": "llm_busy"}
+                    except Exception as e:
+                        index = futures[future]
+                        result = {"index": index, "question": questions[index], "error": f"Error processing question: {str(e)}"}
+                    yield json.dumps(result) + "\n"
+            finally:
+                for future in futures:
+                    future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/documents', methods=['GET'])
 def list_documents():
-    folder = request.args.get('folder', None)
-    if folder:
-        filtered_docs = [doc for doc in documents_metadata.values() if doc.get('folder') == folder]
-        return jsonify({"documents": filtered_docs}), 200
-    return jsonify({"documents": list(documents_metadata.values())}), 200
+    folder = request.args.get('folder', None) or None
+    sort = request.args.get('sort', 'uploaded_at')
+    descending = request.args.get('order', 'desc') != 'asc'
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    cursor = request.args.get('cursor', None)
+    
+    try:
+        docs, next_cursor = document_store.list(
+            folder=folder, sort=sort, descending=descending, limit=limit, cursor=cursor
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"documents": docs, "next_cursor": next_cursor}), 200
 
 @app.route('/documents/<doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
-    if doc_id not in documents_metadata:
+    doc = document_store.get(doc_id)
+    if doc is None:
         return jsonify({"error": "Document not found"}), 404
     
     try:
-        doc = documents_metadata[doc_id]
         filepath = doc['filepath']
         
         if os.path.exists(filepath):
             os.remove(filepath)
         
-        vectorstore = Chroma(
-            client=chroma_client,
-            collection_name="documents",
-            embedding_function=embeddings
-        )
-        vectorstore.delete(where={"doc_id": doc_id})
+        get_vectorstore().delete_document(doc_id)
+        lexical_index.delete_document(doc_id)
+        invalidate_caches(doc_id)
         
-        del documents_metadata[doc_id]
-        save_metadata()
+        document_store.delete(doc_id)
         
         return jsonify({"message": "Document deleted successfully"}), 200
     except Exception as e:
         return jsonify({"error": f"Error deleting document: {str(e)}"}), 500
 
+@app.route('/documents/<doc_id>', methods=['PUT'])
+def update_document(doc_id):
+    request.max_content_length = TXT_MAX_CONTENT_LENGTH
+    doc = document_store.get(doc_id)
+    if doc is None:
+        return jsonify({"error": "Document not found"}), 404
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+    if not allowed_file(file.filename):
+        return jsonify({"error": "File type not allowed. Supported formats: PDF, DOCX, TXT"}), 400
+    
+    filename = secure_filename(file.filename)
+    # A fresh name per revision: the current file stays in place until the re-index succeeds
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{doc_id}_{uuid.uuid4().hex[:8]}_{filename}")
+    file.save(filepath)
+    if discard_if_oversized(filepath, filename):
+        return jsonify({"error": "File too large"}), 413
+    
+    job = job_queue.submit('reindex', {
+        "filepath": filepath,
+        "filename": filename,
+        "doc_id": doc_id
+    })
+    return jsonify({
+        "message": "File uploaded, re-indexing queued",
+        "job_id": job['id'],
+        "doc_id": doc_id,
+        "filename": filename,
+        "folder": doc['folder'],
+        "status": job['status']
+    }), 202
+
 @app.route('/documents/<doc_id>/preview', methods=['GET'])
 def get_document_preview(doc_id):
-    if doc_id not in documents_metadata:
+    doc = document_store.get(doc_id)
+    if doc is None:
         return jsonify({"error": "Document not found"}), 404
     
-    doc = documents_metadata[doc_id]
     return jsonify({
         "id": doc_id,
         "filename": doc['filename'],
@@ -361,42 +1661,40 @@ def get_document_preview(doc_id):
 
 @app.route('/documents/<doc_id>/folder', methods=['PUT'])
 def update_document_folder(doc_id):
-    if doc_id not in documents_metadata:
-        return jsonify({"error": "Document not found"}), 404
-    
     data = request.json
     folder = data.get('folder', None)
     
-    documents_metadata[doc_id]['folder'] = folder
-    save_metadata()
+    if not document_store.set_folder(doc_id, folder):
+        return jsonify({"error": "Document not found"}), 404
     
     return jsonify({"message": "Document folder updated", "folder": folder}), 200
 
 @app.route('/folders', methods=['GET'])
 def get_folders():
-    folders = set()
-    for doc in documents_metadata.values():
-        folder = doc.get('folder')
-        if folder:
-            folders.add(folder)
-    return jsonify({"folders": sorted(list(folders))}), 200
+    counts = document_store.folder_counts()
+    return jsonify({"folders": list(counts), "counts": counts}), 200
 
 @app.route('/conversations', methods=['GET'])
 def get_conversations():
-    return jsonify({"conversations": conversations}), 200
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    return jsonify({
+        "conversations": conversation_store.list(limit=limit, offset=offset),
+        "total": conversation_store.count(),
+        "limit": limit,
+        "offset": offset
+    }), 200
 
 @app.route('/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
-    for conv in conversations:
-        if conv['id'] == conversation_id:
-            return jsonify(conv), 200
-    return jsonify({"error": "Conversation not found"}), 404
+    conv = conversation_store.get(conversation_id)
+    if conv is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    return jsonify(conv), 200
 
 @app.route('/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
-    global conversations
-    conversations = [c for c in conversations if c['id'] != conversation_id]
-    save_conversations()
+    conversation_store.delete(conversation_id)
     return jsonify({"message": "Conversation deleted successfully"}), 200
 
 @app.route('/conversations/<conversation_id>/export', methods=['GET'])
@@ -410,97 +1708,97 @@ def export_conversation(conversation_id):
     
     format_type = request.args.get('format', 'markdown')
     
-    for conv in conversations:
-        if conv['id'] == conversation_id:
-            if format_type == 'pdf':
-                buffer = io.BytesIO()
-                doc = SimpleDocTemplate(buffer, pagesize=letter,
-                                      rightMargin=72, leftMargin=72,
-                                      topMargin=72, bottomMargin=18)
-                
-                styles = getSampleStyleSheet()
-                title_style = ParagraphStyle(
-                    'CustomTitle',
-                    parent=styles['Heading1'],
-                    fontSize=24,
-                    textColor='#2563EB'
-                )
-                heading_style = ParagraphStyle(
-                    'CustomHeading',
-                    parent=styles['Heading2'],
-                    fontSize=16,
-                    textColor='#1E293B'
-                )
-                normal_style = styles['BodyText']
-                
-                story = []
-                
-                story.append(Paragraph("Conversation Export", title_style))
-                story.append(Spacer(1, 12))
-                story.append(Paragraph(f"<b>Created:</b> {conv['created_at']}", normal_style))
-                story.append(Paragraph(f"<b>Last Updated:</b> {conv['updated_at']}", normal_style))
+    conv = conversation_store.get(conversation_id)
+    if conv is None:
+        return jsonify({"error": "Conversation not found"}), 404
+    
+    if format_type == 'pdf':
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter,
+                              rightMargin=72, leftMargin=72,
+                              topMargin=72, bottomMargin=18)
+        
+        styles = getSampleStyleSheet()
+        title_style = ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor='#2563EB'
+        )
+        heading_style = ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            textColor='#1E293B'
+        )
+        normal_style = styles['BodyText']
+        
+        story = []
+        
+        story.append(Paragraph("Conversation Export", title_style))
+        story.append(Spacer(1, 12))
+        story.append(Paragraph(f"<b>Created:</b> {conv['created_at']}", normal_style))
+        story.append(Paragraph(f"<b>Last Updated:</b> {conv['updated_at']}", normal_style))
+        story.append(Spacer(1, 24))
+        
+        for i, msg in enumerate(conv['messages']):
+            if i > 0:
                 story.append(Spacer(1, 24))
-                
-                for i, msg in enumerate(conv['messages']):
-                    if i > 0:
-                        story.append(Spacer(1, 24))
-                    
-                    timestamp = msg.get('timestamp', '')
-                    if timestamp:
-                        story.append(Paragraph(f"<i>{timestamp}</i>", normal_style))
-                        story.append(Spacer(1, 6))
-                    
-                    story.append(Paragraph("Question", heading_style))
-                    story.append(Spacer(1, 6))
-                    story.append(Paragraph(msg['question'], normal_style))
-                    story.append(Spacer(1, 12))
-                    
-                    story.append(Paragraph("Answer", heading_style))
-                    story.append(Spacer(1, 6))
-                    story.append(Paragraph(msg['answer'], normal_style))
-                    
-                    if msg.get('sources'):
-                        story.append(Spacer(1, 12))
-                        story.append(Paragraph("Sources", heading_style))
-                        story.append(Spacer(1, 6))
-                        for src in msg['sources']:
-                            source_text = f"<b>{src['source']}</b> (Chunk {src['chunk'] + 1}): {src['content']}"
-                            story.append(Paragraph(source_text, normal_style))
-                            story.append(Spacer(1, 4))
-                
-                doc.build(story)
-                pdf_data = buffer.getvalue()
-                buffer.close()
-                
-                return pdf_data, 200, {
-                    'Content-Type': 'application/pdf',
-                    'Content-Disposition': f'attachment; filename=conversation-{conversation_id}.pdf'
-                }
             
-            elif format_type == 'markdown':
-                md_content = f"# Conversation Export\n\n"
-                md_content += f"**Created:** {conv['created_at']}\n\n"
-                md_content += f"**Last Updated:** {conv['updated_at']}\n\n"
-                md_content += "---\n\n"
-                
-                for msg in conv['messages']:
-                    timestamp = msg.get('timestamp', '')
-                    if timestamp:
-                        md_content += f"*{timestamp}*\n\n"
-                    
-                    md_content += f"## Question\n{msg['question']}\n\n"
-                    md_content += f"## Answer\n{msg['answer']}\n\n"
-                    if msg.get('sources'):
-                        md_content += "### Sources\n"
-                        for src in msg['sources']:
-                            md_content += f"- **{src['source']}** (Chunk {src['chunk'] + 1}): {src['content']}\n"
-                    md_content += "\n---\n\n"
-                
-                return jsonify({"content": md_content, "format": "markdown"}), 200
-            else:
-                return jsonify(conv), 200
+            timestamp = msg.get('timestamp', '')
+            if timestamp:
+                story.append(Paragraph(f"<i>{timestamp}</i>", normal_style))
+                story.append(Spacer(1, 6))
+            
+            story.append(Paragraph("Question", heading_style))
+            story.append(Spacer(1, 6))
+            story.append(Paragraph(msg['question'], normal_style))
+            story.append(Spacer(1, 12))
+            
+            story.append(Paragraph("Answer", heading_style))
+            story.append(Spacer(1, 6))
+            story.append(Paragraph(msg['answer'], normal_style))
+            
+            if msg.get('sources'):
+                story.append(Spacer(1, 12))
+                story.append(Paragraph("Sources", heading_style))
+                story.append(Spacer(1, 6))
+                for src in msg['sources']:
+                    source_text = f"<b>{src['source']}</b> (Chunk {src['chunk'] + 1}): {src['content']}"
+                    story.append(Paragraph(source_text, normal_style))
+                    story.append(Spacer(1, 4))
+        
+        doc.build(story)
+        pdf_data = buffer.getvalue()
+        buffer.close()
+        
+        return pdf_data, 200, {
+            'Content-Type': 'application/pdf',
+            'Content-Disposition': f'attachment; filename=conversation-{conversation_id}.pdf'
+        }
     
-    return jsonify({"error": "Conversation not found"}), 404
+    elif format_type == 'markdown':
+        md_content = f"# Conversation Export\n\n"
+        md_content += f"**Created:** {conv['created_at']}\n\n"
+        md_content += f"**Last Updated:** {conv['updated_at']}\n\n"
+        md_content += "---\n\n"
+        
+        for msg in conv['messages']:
+            timestamp = msg.get('timestamp', '')
+            if timestamp:
+                md_content += f"*{timestamp}*\n\n"
+            
+            md_content += f"## Question\n{msg['question']}\n\n"
+            md_content += f"## Answer\n{msg['answer']}\n\n"
+            if msg.get('sources'):
+                md_content += "### Sources\n"
+                for src in msg['sources']:
+                    md_content += f"- **{src['source']}** (Chunk {src['chunk'] + 1}): {src['content']}\n"
+            md_content += "\n---\n\n"
+        
+        return jsonify({"content": md_content, "format": "markdown"}), 200
+    else:
+        return jsonify(conv), 200
 
 @app.route('/models', methods=['GET'])
 def list_models():
@@ -512,11 +1810,11 @@ def list_models():
                 "models": []
             }), 503
         
-        models_response = ollama.list(host=model_config['ollama_base_url'])
+        models_response = ollama_service.list()
         models = []
         
         for model in models_response.get('models', []):
-            model_name = model.get('name', '').split(':')[0]
+            model_name = (model.get('model') or model.get('name') or '').split(':')[0]
             models.append({
                 'name': model_name,
                 'size': model.get('size', 0),
@@ -527,6 +1825,12 @@ def list_models():
             "models": models,
             "ollama_connected": True
         }), 200
+    except ConnectionError as e:
+        return jsonify({
+            "error": f"Cannot connect to Ollama: {e}",
+            "models": [],
+            "ollama_connected": False
+        }), 503
     except Exception as e:
         return jsonify({
             "error": str(e),
@@ -540,33 +1844,57 @@ def get_model_config():
 
 @app.route('/models/config', methods=['PUT'])
 def update_model_config():
-    global model_config, embeddings
-    
     data = request.json
     
-    embedding_model_changed = False
-    if 'embedding_model' in data and data['embedding_model'] != model_config['embedding_model']:
-        if documents_metadata:
-            return jsonify({
-                "error": "Cannot change embedding model while documents exist. Please delete all documents first, or they will need to be re-uploaded after changing the model.",
-                "warning": "Changing embedding model requires re-uploading all documents"
-            }), 400
-        embedding_model_changed = True
-        model_config['embedding_model'] = data['embedding_model']
-    
-    if 'llm_model' in data:
-        model_config['llm_model'] = data['llm_model']
-    
-    if 'ollama_base_url' in data:
-        model_config['ollama_base_url'] = data['ollama_base_url']
-    
-    if embedding_model_changed or 'ollama_base_url' in data:
-        embeddings = OllamaEmbeddings(
-            model=model_config['embedding_model'], 
-            base_url=model_config['ollama_base_url']
-        )
+    budgets = data.get('context_token_budgets', {})
+    if not isinstance(budgets, dict) or not all(
+        isinstance(budget, int) and not isinstance(budget, bool) and budget > 0 for budget in budgets.values()
+    ):
+        return jsonify({"error": "context_token_budgets must map model names to positive token counts"}), 400
+    
+    threshold = data.get('answer_cache_threshold', DEFAULT_ANSWER_CACHE_THRESHOLD)
+    if not isinstance(threshold, (int, float)) or isinstance(threshold, bool) or not 0 < threshold <= 1:
+        return jsonify({"error": "answer_cache_threshold must be a number between 0 (exclusive) and 1"}), 400
+    
+    concurrency = data.get('llm_max_concurrency', DEFAULT_LLM_MAX_CONCURRENCY)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        return jsonify({"error": "llm_max_concurrency must be a positive integer"}), 400
+    
+    if data.get('vector_backend', 'chroma') not in VECTOR_BACKENDS:
+        return jsonify({"error": f"vector_backend must be one of: {', '.join(VECTOR_BACKENDS)}"}), 400
+    if data.get('vector_dtype', 'int8') not in NUMPY_INDEX_DTYPES:
+        return jsonify({"error": f"vector_dtype must be one of: {', '.join(NUMPY_INDEX_DTYPES)}"}), 400
+    vector_store_changed = any(
+        key in data and data[key] != model_config.get(key, default)
+        for key, default in (('vector_backend', 'chroma'), ('vector_dtype', 'int8'))
+    )
+    embedding_model_changed = 'embedding_model' in data and data['embedding_model'] != model_config['embedding_model']
+    if (vector_store_changed or embedding_model_changed) and model_config.get('embedding_migration') is not None:
+        return jsonify({
+            "error": "An embedding migration is in progress. Wait for it to finish, or cancel it with DELETE /models/migration first."
+        }), 409
+    if vector_store_changed and document_store.count():
+        return jsonify({
+            "error": "Cannot change the vector backend while documents exist. Please delete all documents first, or they will need to be re-uploaded after the change."
+        }), 400
+    
+    if embedding_model_changed and document_store.count():
+        return jsonify({
+            "error": "Cannot switch the embedding model directly while documents exist. Use POST /models/migration to re-embed them in the background without downtime.",
+            "warning": "Queries keep using the current model until the migration cuts over"
+        }), 400
     
-    save_model_config()
+    config = dict(model_config)
+    for key in ('embedding_model', 'llm_model', 'ollama_base_url', 'context_token_budgets', 'answer_cache_threshold',
+                'llm_max_concurrency', 'vector_backend', 'vector_dtype'):
+        if key in data:
+            config[key] = data[key]
+    
+    # Saved only if no other worker saved a newer version since this one synced; every worker then picks it up
+    version = shared_state.save_setting('model_config', config, config_version)
+    if version is None:
+        return jsonify({"error": "The configuration was changed by another request. Please reload it and try again."}), 409
+    apply_model_config(config, version)
     
     return jsonify({
         "message": "Model configuration updated successfully",
@@ -574,5 +1902,83 @@ def update_model_config():
         "embedding_changed": embedding_model_changed
     }), 200
 
+def migration_status(migration):
+    jobs = job_queue.store.pending('embedding_migration')
+    return {"migration": migration, "job": jobs[-1] if jobs else None}
+
+@app.route('/models/migration', methods=['GET'])
+def get_embedding_migration():
+    return jsonify(migration_status(model_config.get('embedding_migration'))), 200
+
+@app.route('/models/migration', methods=['POST'])
+def start_embedding_migration():
+    data = request.json or {}
+    target = data.get('embedding_model')
+    if not isinstance(target, str) or not target:
+        return jsonify({"error": "embedding_model is required"}), 400
+    
+    migration = model_config.get('embedding_migration')
+    if migration is not None:
+        if job_queue.store.pending('embedding_migration') or migration['embedding_model'] != target:
+            return jsonify({"error": "An embedding migration is already in progress", **migration_status(migration)}), 409
+        # Resuming after a failure: chunks already copied to the new collection are not embedded again
+        job = job_queue.submit('embedding_migration', {
+            "migration_id": migration['id'],
+            "embedding_model": target,
+            "collection": migration['collection'],
+            "previous_collection": migration['previous_collection']
+        })
+        return jsonify({"message": "Embedding migration resumed", "job_id": job['id'], "migration": migration}), 202
+    
+    if target == model_config['embedding_model']:
+        return jsonify({"error": f"Documents are already embedded with {target}"}), 400
+    if not document_store.count():
+        return jsonify({"error": "There are no documents to migrate; change embedding_model through PUT /models/config instead"}), 400
+    
+    migration_id = uuid.uuid4().hex[:8]
+    migration = {
+        "id": migration_id,
+        "embedding_model": target,
+        "collection": f"{DEFAULT_VECTOR_COLLECTION}_{migration_id}",
+        "previous_collection": model_config.get('vector_collection', DEFAULT_VECTOR_COLLECTION),
+        "started_at": datetime.now().isoformat(),
+        # Deletes logged after this point are replayed into the new collection before cutover
+        "changes_from": shared_state.latest_change()
+    }
+    config = dict(model_config, embedding_migration=migration)
+    version = shared_state.save_setting('model_config', config, config_version)
+    if version is None:
+        return jsonify({"error": "The configuration was changed by another request. Please reload it and try again."}), 409
+    # From here on every worker writes new chunks to both collections
+    apply_model_config(config, version)
+    job = job_queue.submit('embedding_migration', {
+        "migration_id": migration_id,
+        "embedding_model": target,
+        "collection": migration['collection'],
+        "previous_collection": migration['previous_collection']
+    })
+    return jsonify({"message": "Embedding migration started", "job_id": job['id'], "migration": migration}), 202
+
+@app.route('/models/migration', methods=['DELETE'])
+def cancel_embedding_migration():
+    migration = model_config.get('embedding_migration')
+    if migration is None:
+        return jsonify({"error": "No embedding migration in progress"}), 404
+    config = dict(model_config)
+    del config['embedding_migration']
+    version = shared_state.save_setting('model_config', config, config_version)
+    if version is None:
+        return jsonify({"error": "The configuration was changed by another request. Please reload it and try again."}), 409
+    apply_model_config(config, version)
+    # A queued or running migration job notices at its next document and drops the new collection itself
+    if not job_queue.store.pending('embedding_migration'):
+        open_vector_collection(migration['collection'], None).drop()
+    return jsonify({"message": "Embedding migration cancelled", "migration": migration}), 200
+
+startup_seconds.set(time.perf_counter() - import_started, phase='import')
+
 if __name__ == '__main__':
+    create_app()
+    if WARMUP_ON_START:
+        start_warmup()
     app.run(host='0.0.0.0', port=8000, debug=True)
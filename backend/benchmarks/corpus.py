@@ -0,0 +1,94 @@
+import io
+import random
+
+from docx import Document as DocxDocument
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+TOPICS = ['leave', 'expenses', 'security', 'travel', 'onboarding', 'equipment', 'overtime', 'privacy', 'safety', 'training']
+WORDS = [
+    'employee', 'manager', 'approval', 'request', 'policy', 'must', 'should', 'within', 'days', 'form',
+    'department', 'record', 'report', 'review', 'annual', 'quarterly', 'submit', 'receipt', 'limit', 'exception',
+    'compliance', 'access', 'badge', 'laptop', 'contract', 'training', 'session', 'deadline', 'budget', 'office'
+]
+
+
+def paragraph(rng, topic, index):
+    sentences = []
+    for _ in range(rng.randint(3, 6)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+        sentences.append(' '.join(words).capitalize() + '.')
+    # Every paragraph carries an ID-like token so keyword lookups have something to hit
+    return f"Section {index} ({topic}, clause {topic[:3].upper()}-{index:04d}): " + ' '.join(sentences)
+
+
+def document_paragraphs(seed, paragraphs):
+    rng = random.Random(seed)
+    topic = TOPICS[seed % len(TOPICS)]
+    return topic, [paragraph(rng, topic, i) for i in range(paragraphs)]
+
+
+def make_txt(paragraphs):
+    return '\n\n'.join(paragraphs).encode('utf-8')
+
+
+def make_docx(paragraphs):
+    doc = DocxDocument()
+    for text in paragraphs:
+        doc.add_paragraph(text)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf(paragraphs, paragraphs_per_page=4):
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    for start in range(0, len(paragraphs), paragraphs_per_page):
+        text = pdf.beginText(40, height - 50)
+        for body in paragraphs[start:start + paragraphs_per_page]:
+            line = ''
+            for word in body.split():
+                if len(line) + len(word) > 95:
+                    text.textLine(line)
+                    line = ''
+                line = f"{line} {word}" if line else word
+            text.textLine(line)
+            text.textLine('')
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def generate_corpus(count, paragraphs=30, formats=('txt', 'docx', 'pdf')):
+    builders = {'txt': make_txt, 'docx': make_docx, 'pdf': make_pdf}
+    corpus = []
+    for i in range(count):
+        ext = formats[i % len(formats)]
+        topic, body = document_paragraphs(i, paragraphs)
+        corpus.append({
+            "filename": f"bench_{i:05d}_{topic}.{ext}",
+            "folder": f"bench-{topic}",
+            "content": builders[ext](body)
+        })
+    return corpus
+
+
+def generate_questions(count, seed=0):
+    rng = random.Random(seed)
+    templates = [
+        "What is the {topic} policy on {word}?",
+        "When must an employee submit the {topic} {word}?",
+        "Who approves {topic} {word} requests?",
+        "{code}"
+    ]
+    questions = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        template = rng.choice(templates)
+        questions.append(template.format(
+            topic=topic, word=rng.choice(WORDS), code=f"{topic[:3].upper()}-{rng.randint(0, 29):04d}"
+        ))
+    return questions
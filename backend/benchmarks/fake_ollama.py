@@ -0,0 +1,147 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODELS = ['llama3.2:latest', 'nomic-embed-text:latest']
+
+
+def embed_text(text, dim):
+    # Seeded from the text so the same chunk or question always gets the same vector across runs
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class FakeOllama:
+    def __init__(self, host='127.0.0.1', port=11500, dim=768, embed_delay=0.0, token_delay=0.01, tokens=40):
+        self.host = host
+        self.port = port
+        self.dim = dim
+        self.embed_delay = embed_delay
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.calls = {'embed': 0, 'generate': 0, 'list': 0}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def count(self, kind, n=1):
+        with self._lock:
+            self.calls[kind] += n
+
+    def answer_words(self, prompt):
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+        words = ['the', 'policy', 'document', 'states', 'that', 'employees', 'must', 'follow', 'section', 'rules']
+        return [rng.choice(words) for _ in range(self.tokens)]
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, obj, status=200):
+                body = json.dumps(obj).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_chunk(self, obj):
+                line = json.dumps(obj).encode() + b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+
+            def do_GET(self):
+                if self.path.startswith('/api/tags'):
+                    fake.count('list')
+                    self.send_json({
+                        "models": [
+                            {"name": name, "model": name, "size": 1, "modified_at": "2024-01-01T00:00:00Z"}
+                            for name in MODELS
+                        ]
+                    })
+                elif self.path.startswith('/api/version'):
+                    self.send_json({"version": "0.0.0-fake"})
+                else:
+                    self.send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/api/embeddings':
+                    fake.count('embed')
+                    time.sleep(fake.embed_delay)
+                    self.send_json({"embedding": embed_text(body['prompt'], fake.dim)})
+                elif self.path == '/api/embed':
+                    inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+                    fake.count('embed', len(inputs))
+                    time.sleep(fake.embed_delay * len(inputs))
+                    self.send_json({"model": body['model'], "embeddings": [embed_text(text, fake.dim) for text in inputs]})
+                elif self.path == '/api/generate':
+                    fake.count('generate')
+                    words = fake.answer_words(body.get('prompt', ''))
+                    if body.get('stream', True):
+                        self.send_response(200)
+                        self.send_header('Content-Type', 'application/x-ndjson')
+                        self.send_header('Transfer-Encoding', 'chunked')
+                        self.end_headers()
+                        for word in words:
+                            time.sleep(fake.token_delay)
+                            self.send_chunk({"model": body['model'], "response": word + ' ', "done": False})
+                        self.send_chunk({"model": body['model'], "response": '', "done": True})
+                        self.wfile.write(b'0\r\n\r\n')
+                    else:
+                        time.sleep(fake.token_delay * len(words))
+                        self.send_json({"model": body['model'], "response": ' '.join(words), "done": True})
+                else:
+                    self.send_json({"error": "not found"}, status=404)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-ollama', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server with deterministic embeddings")
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--embed-delay-ms', type=float, default=0.0)
+    parser.add_argument('--token-delay-ms', type=float, default=10.0)
+    parser.add_argument('--tokens', type=int, default=40)
+    args = parser.parse_args()
+
+    fake = FakeOllama(
+        port=args.port, dim=args.dim, embed_delay=args.embed_delay_ms / 1000,
+        token_delay=args.token_delay_ms / 1000, tokens=args.tokens
+    )
+    fake.start()
+    print(f"Fake Ollama listening on {fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
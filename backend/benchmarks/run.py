@@ -0,0 +1,401 @@
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import httpx
+
+from benchmarks.corpus import generate_corpus, generate_questions
+from benchmarks.fake_ollama import FakeOllama
+from storage import ConversationStore, DocumentStore
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmarks', 'results')
+LAUNCH_BACKEND = "import sys, app; app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.items = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.finished = time.perf_counter()
+
+    def record(self, seconds, items=1):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.items += items
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        wall = (self.finished or time.perf_counter()) - self.started
+        ms = lambda value: round(value * 1000, 2) if value is not None else None
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "items": self.items,
+            "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(len(latencies) / wall, 2) if wall else None,
+            "items_per_second": round(self.items / wall, 2) if wall else None,
+            "latency_ms": {
+                "mean": ms(sum(latencies) / len(latencies)) if latencies else None,
+                "p50": ms(percentile(latencies, 50)),
+                "p95": ms(percentile(latencies, 95)),
+                "p99": ms(percentile(latencies, 99)),
+                "max": ms(latencies[-1]) if latencies else None
+            }
+        }
+
+
+def run_concurrently(work, items, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(work, items))
+
+
+def start_backend(workdir, port, log):
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.Popen(
+        [sys.executable, '-c', LAUNCH_BACKEND, str(port)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+def wait_until(client, process, path, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup; see the backend log")
+        try:
+            response = client.get(path)
+            if response.status_code == 200:
+                return response.json()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"Backend {path} did not return 200 after {timeout}s")
+
+
+def bench_upload(client, corpus, concurrency):
+    upload = Stage('upload')
+    ingest = Stage('ingest')
+
+    def upload_one(doc):
+        started = time.perf_counter()
+        try:
+            response = client.post(
+                '/upload',
+                files={'file': (doc['filename'], doc['content'])},
+                data={'folder': doc['folder']}
+            )
+            response.raise_for_status()
+        except Exception:
+            upload.error()
+            ingest.error()
+            return
+        upload.record(time.perf_counter() - started)
+        job_id = response.json()['job_id']
+        while True:
+            job = client.get(f'/jobs/{job_id}').json()
+            if job['status'] == 'completed':
+                ingest.record(time.perf_counter() - started, items=job['result']['chunks'])
+                return
+            if job['status'] == 'failed':
+                ingest.error()
+                return
+            time.sleep(0.05)
+
+    with upload, ingest:
+        run_concurrently(upload_one, corpus, concurrency)
+    return upload, ingest
+
+
+def bench_ask(client, questions, requests, concurrency):
+    ask = Stage('ask')
+
+    def ask_one(i):
+        started = time.perf_counter()
+        try:
+            client.post('/ask', json={'question': questions[i % len(questions)]}).raise_for_status()
+        except Exception:
+            ask.error()
+            return
+        ask.record(time.perf_counter() - started)
+
+    with ask:
+        run_concurrently(ask_one, range(requests), concurrency)
+    return ask
+
+
+def bench_ask_stream(client, questions, requests, concurrency):
+    first_token = Stage('ask_stream_first_token')
+    complete = Stage('ask_stream_complete')
+
+    def ask_one(i):
+        started = time.perf_counter()
+        seen_token = False
+        try:
+            with client.stream('POST', '/ask/stream', json={'question': questions[i % len(questions)]}) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if line.startswith('event: token') and not seen_token:
+                        seen_token = True
+                        first_token.record(time.perf_counter() - started)
+                    elif line.startswith('event: error'):
+                        raise RuntimeError("stream error")
+        except Exception:
+            first_token.error()
+            complete.error()
+            return
+        complete.record(time.perf_counter() - started)
+
+    with first_token, complete:
+        run_concurrently(ask_one, range(requests), concurrency)
+    return first_token, complete
+
+
+def seed_metadata(workdir, documents, conversations):
+    # Rows are written straight to the backend's stores: listing cost depends on row count, not on vectors
+    document_store = DocumentStore(os.path.join(workdir, 'documents.db'))
+    base = datetime(2024, 1, 1)
+    for start in range(0, documents, 5000):
+        document_store.add_many([
+            {
+                "id": str(uuid.uuid4()),
+                "filename": f"seeded_{i:07d}.pdf",
+                "chunks": 10,
+                "filepath": '',
+                "folder": f"seeded-{i % 50}",
+                "uploaded_at": (base + timedelta(seconds=i)).isoformat(),
+                "text_preview": ''
+            }
+            for i in range(start, min(start + 5000, documents))
+        ])
+    conversation_store = ConversationStore(os.path.join(workdir, 'conversations.db'))
+    conversation_store.import_conversations([
+        {
+            "id": str(uuid.uuid4()),
+            "created_at": (base + timedelta(seconds=i)).isoformat(),
+            "updated_at": (base + timedelta(seconds=i)).isoformat(),
+            "messages": [{"question": f"Seeded question {i}?", "answer": "Seeded answer.", "sources": []}]
+        }
+        for i in range(conversations)
+    ])
+
+
+def bench_listing(client, pages, concurrency):
+    stages = {name: Stage(name) for name in ('list_documents', 'list_documents_folder', 'folders', 'list_conversations')}
+
+    def timed(stage, path, params=None):
+        started = time.perf_counter()
+        try:
+            response = client.get(path, params=params)
+            response.raise_for_status()
+        except Exception:
+            stage.error()
+            return None
+        stage.record(time.perf_counter() - started)
+        return response.json()
+
+    def walk_documents(folder):
+        stage = stages['list_documents_folder' if folder else 'list_documents']
+        cursor = None
+        for _ in range(pages):
+            params = {'limit': 50, **({'folder': folder} if folder else {}), **({'cursor': cursor} if cursor else {})}
+            page = timed(stage, '/documents', params)
+            cursor = page and page['next_cursor']
+            if not cursor:
+                break
+
+    def walk_conversations(_):
+        for page in range(pages):
+            timed(stages['list_conversations'], '/conversations', {'limit': 50, 'offset': page * 50})
+
+    with stages['list_documents'], stages['list_documents_folder']:
+        run_concurrently(walk_documents, [None] * concurrency + [f"seeded-{i}" for i in range(concurrency)], concurrency * 2)
+    with stages['folders']:
+        run_concurrently(lambda _: timed(stages['folders'], '/folders'), range(pages), concurrency)
+    with stages['list_conversations']:
+        run_concurrently(walk_conversations, range(concurrency), concurrency)
+    return list(stages.values())
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}, {baseline.get('started_at')}):")
+    for name, stage in results['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if not before or not before['latency_ms']['p95'] or not stage['latency_ms']['p95']:
+            continue
+        change = (stage['latency_ms']['p95'] - before['latency_ms']['p95']) / before['latency_ms']['p95'] * 100
+        print(f"  {name:<26} p95 {before['latency_ms']['p95']:>9} -> {stage['latency_ms']['p95']:>9} ms ({change:+.1f}%)")
+
+
+def print_summary(results):
+    print(f"\n{'stage':<26} {'reqs':>6} {'err':>4} {'req/s':>8} {'items/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stage in results['stages'].items():
+        latency = stage['latency_ms']
+        print(
+            f"{name:<26} {stage['requests']:>6} {stage['errors']:>4} {stage['throughput_per_second'] or 0:>8} "
+            f"{stage['items_per_second'] or 0:>9} {latency['p50'] or 0:>9} {latency['p95'] or 0:>9} {latency['p99'] or 0:>9}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the backend against a stand-in Ollama server")
+    parser.add_argument('--port', type=int, default=8765, help="port for the backend under test")
+    parser.add_argument('--ollama-port', type=int, default=11500)
+    parser.add_argument('--embedding-dim', type=int, default=768)
+    parser.add_argument('--embed-delay-ms', type=float, default=0.0, help="simulated latency per embedded text")
+    parser.add_argument('--token-delay-ms', type=float, default=10.0, help="simulated latency per generated token")
+    parser.add_argument('--answer-tokens', type=int, default=40)
+    parser.add_argument('--documents', type=int, default=30, help="generated PDF/DOCX/TXT files to upload")
+    parser.add_argument('--paragraphs', type=int, default=30, help="paragraphs per generated document")
+    parser.add_argument('--upload-concurrency', type=int, default=4)
+    parser.add_argument('--questions', type=int, default=50, help="distinct questions; asks cycle through them")
+    parser.add_argument('--ask-requests', type=int, default=200)
+    parser.add_argument('--stream-requests', type=int, default=50)
+    parser.add_argument('--ask-concurrency', type=int, default=8)
+    parser.add_argument('--seed-documents', type=int, default=20000, help="metadata-only documents added before listing")
+    parser.add_argument('--seed-conversations', type=int, default=5000)
+    parser.add_argument('--list-pages', type=int, default=20)
+    parser.add_argument('--list-concurrency', type=int, default=4)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="earlier result file to compare p95 latencies against")
+    parser.add_argument('--keep-workdir', action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='docuquery-bench-')
+    backend_workdir = os.path.join(workdir, 'backend')
+    os.makedirs(backend_workdir)
+    with open(os.path.join(backend_workdir, 'model_config.json'), 'w') as f:
+        json.dump({
+            "embedding_model": "nomic-embed-text",
+            "llm_model": "llama3.2",
+            "ollama_base_url": f"http://127.0.0.1:{args.ollama_port}"
+        }, f)
+
+    fake = FakeOllama(
+        port=args.ollama_port, dim=args.embedding_dim, embed_delay=args.embed_delay_ms / 1000,
+        token_delay=args.token_delay_ms / 1000, tokens=args.answer_tokens
+    )
+    fake.start()
+    log = open(os.path.join(workdir, 'backend.log'), 'w')
+    started_at = datetime.now().isoformat()
+    startup = Stage('startup')
+    ready = Stage('startup_ready')
+    startup.started = ready.started = time.perf_counter()
+    backend = start_backend(backend_workdir, args.port, log)
+    stages = []
+    startup_seconds = None
+    client = httpx.Client(
+        base_url=f"http://127.0.0.1:{args.port}", timeout=600,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64)
+    )
+    try:
+        # Liveness (/health) answers before the heavy subsystems load; readiness (/ready) waits for the warm-up
+        wait_until(client, backend, '/health', args.startup_timeout)
+        startup.finished = time.perf_counter()
+        startup.record(startup.finished - startup.started)
+        stages.append(startup)
+        startup_seconds = wait_until(client, backend, '/ready', args.startup_timeout)['startup_seconds']
+        ready.finished = time.perf_counter()
+        ready.record(ready.finished - ready.started)
+        stages.append(ready)
+
+        print(f"Uploading {args.documents} generated documents...")
+        corpus = generate_corpus(args.documents, paragraphs=args.paragraphs)
+        stages.extend(bench_upload(client, corpus, args.upload_concurrency))
+
+        questions = generate_questions(args.questions)
+        print(f"Asking {args.ask_requests} questions ({args.ask_concurrency} concurrent)...")
+        stages.append(bench_ask(client, questions, args.ask_requests, args.ask_concurrency))
+        print(f"Streaming {args.stream_requests} answers...")
+        stages.extend(bench_ask_stream(client, questions, args.stream_requests, args.ask_concurrency))
+
+        print(f"Seeding {args.seed_documents} documents and {args.seed_conversations} conversations, then listing...")
+        seed_metadata(backend_workdir, args.seed_documents, args.seed_conversations)
+        stages.extend(bench_listing(client, args.list_pages, args.list_concurrency))
+    finally:
+        client.close()
+        backend.terminate()
+        try:
+            backend.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            backend.kill()
+        log.close()
+        fake.stop()
+
+    results = {
+        "started_at": started_at,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+        "ollama_calls": fake.calls,
+        "startup_seconds": startup_seconds,
+        "stages": {stage.name: stage.summary() for stage in stages}
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print_summary(results)
+    print(f"\nResults written to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    if args.keep_workdir:
+        print(f"Working directory kept at {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
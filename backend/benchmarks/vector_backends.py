@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.run import RESULTS_DIR, git_commit, percentile
+
+BACKENDS = ('chroma', 'numpy-float16', 'numpy-int8')
+
+
+def rss_mb():
+    # Current resident set size; falls back to the peak where /proc is unavailable
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def generate_vectors(count, dim, seed, clusters=64):
+    # Clustered rather than uniform, like embeddings of documents on a handful of topics
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, clusters, count)
+    return centers[assignment] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def open_backend(name, path):
+    if name == 'chroma':
+        import chromadb
+        from vector_store import ChromaVectorStore
+        return ChromaVectorStore(chromadb.PersistentClient(path=path), 'documents', None)
+    from vector_store import NumpyVectorStore
+    return NumpyVectorStore(path, None, dtype=name.split('-', 1)[1])
+
+
+def run_worker(args):
+    # Runs in its own process so each backend's RSS is measured without the others loaded
+    vectors = generate_vectors(args.vectors, args.dim, args.seed)
+    queries = generate_vectors(args.queries, args.dim, args.seed + 1)
+    path = tempfile.mkdtemp(prefix=f'vector-bench-{args.worker}-')
+    try:
+        store = open_backend(args.worker, path)
+        rss_before = rss_mb()
+
+        started = time.perf_counter()
+        for start in range(0, args.vectors, args.batch_size):
+            end = min(start + args.batch_size, args.vectors)
+            store.upsert(
+                ids=[f"doc{i % args.documents}:{i}" for i in range(start, end)],
+                embeddings=vectors[start:end].tolist(),
+                documents=[f"chunk {i}" for i in range(start, end)],
+                metadatas=[{"doc_id": f"doc{i % args.documents}", "chunk": i} for i in range(start, end)]
+            )
+        insert_seconds = time.perf_counter() - started
+
+        latencies = []
+        found = []
+        for query in queries:
+            started = time.perf_counter()
+            response = store.query([query.tolist()], args.k)
+            latencies.append(time.perf_counter() - started)
+            found.append([metadata['chunk'] for metadata in response['metadatas'][0]])
+        scoped_latencies = []
+        scope = [f"doc{i}" for i in range(max(1, args.documents // 10))]
+        for query in queries:
+            started = time.perf_counter()
+            store.query([query.tolist()], args.k, doc_ids=scope)
+            scoped_latencies.append(time.perf_counter() - started)
+        rss_after = rss_mb()
+
+        # Ground truth is exact float32 L2 search, computed after the RSS reading
+        recalls = []
+        for query, result in zip(queries, found):
+            exact = np.argpartition(((vectors - query) ** 2).sum(axis=1), args.k)[:args.k]
+            recalls.append(len(set(result) & set(exact.tolist())) / args.k)
+
+        ms = lambda values: {
+            "p50": round(percentile(sorted(values), 50) * 1000, 3),
+            "p95": round(percentile(sorted(values), 95) * 1000, 3),
+            "p99": round(percentile(sorted(values), 99) * 1000, 3)
+        }
+        disk_bytes = sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+        )
+        return {
+            "recall_at_k": round(sum(recalls) / len(recalls), 4),
+            "query_latency_ms": ms(latencies),
+            "scoped_query_latency_ms": ms(scoped_latencies),
+            "insert_vectors_per_second": round(args.vectors / insert_seconds, 1),
+            "rss_mb": {"before_insert": round(rss_before, 1), "after_queries": round(rss_after, 1),
+                       "growth": round(rss_after - rss_before, 1)},
+            "disk_mb": round(disk_bytes / (1024 * 1024), 1)
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare vector backends on recall, query latency and memory")
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--documents', type=int, default=500, help="vectors are spread over this many doc_ids")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=6, help="results per query (the app asks for twice its k)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--output', help="result file (default: benchmarks/results/vector-<timestamp>.json)")
+    parser.add_argument('--worker', choices=BACKENDS, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=backend_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = {}
+    for name in args.backends.split(','):
+        print(f"Benchmarking {name} with {args.vectors} x {args.dim} vectors...")
+        command = [sys.executable, '-m', 'benchmarks.vector_backends', '--worker', name] + [
+            f"--{key.replace('_', '-')}={value}" for key, value in vars(args).items()
+            if key not in ('worker', 'backends', 'output') and value is not None
+        ]
+        output = subprocess.run(command, cwd=backend_dir, env=env, capture_output=True, text=True, check=True).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"\n{'backend':<15} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'scoped p95':>11} {'RSS MB':>8} {'disk MB':>8} {'insert/s':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<15} {result['recall_at_k']:>9} {result['query_latency_ms']['p50']:>8} "
+            f"{result['query_latency_ms']['p95']:>8} {result['scoped_query_latency_ms']['p95']:>11} "
+            f"{result['rss_mb']['growth']:>8} {result['disk_mb']:>8} {result['insert_vectors_per_second']:>10}"
+        )
+
+    output = args.output or os.path.join(RESULTS_DIR, f"vector-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            "started_at": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {key: value for key, value in vars(args).items() if key != 'worker'},
+            "backends": results
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import re
+
+from documents import Document
+
+# Rough token count for English text; close enough to budget a prompt without loading the model's tokenizer
+CHARS_PER_TOKEN = 4
+MMR_LAMBDA = 0.7
+MIN_OVERLAP_CHARS = 20
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def overlap_length(left, right):
+    # Longest suffix of left that is also a prefix of right (the splitter's chunk_overlap). The overlap is
+    # made of whole words and is usually much longer than MIN_OVERLAP_CHARS; a shorter or mid-word match is
+    # a coincidence (e.g. "documents" and "section 2" sharing an "s"), and cutting it would corrupt the text
+    for size in range(min(len(left), len(right)), MIN_OVERLAP_CHARS - 1, -1):
+        if (left.endswith(right[:size])
+                and (size == len(left) or left[-size - 1].isspace())
+                and (size == len(right) or right[size].isspace())):
+            return size
+    return 0
+
+
+def chunk_key(doc):
+    return doc.metadata.get('doc_id') or '', doc.metadata.get('page') or 0, doc.metadata.get('chunk', 0)
+
+
+def merge_chunks(docs):
+    # Consecutive chunks of the same document (and page) become one passage with the repeated overlap
+    # removed. Passages keep the order in which their first chunk was selected
+    passages = []
+    by_key = {}
+    for doc in sorted(docs, key=chunk_key):
+        doc_id, page, index = chunk_key(doc)
+        previous = by_key.get((doc_id, page, index - 1))
+        if previous is not None:
+            passage = previous
+            overlap = overlap_length(passage['text'], doc.page_content)
+            passage['text'] += doc.page_content[overlap:] if overlap else "\n" + doc.page_content
+        else:
+            passage = {"text": doc.page_content, "metadata": dict(doc.metadata), "docs": []}
+            passages.append(passage)
+        passage['docs'].append(doc)
+        by_key[(doc_id, page, index)] = passage
+
+    selection_order = {id(doc): position for position, doc in enumerate(docs)}
+    passages.sort(key=lambda passage: min(selection_order[id(doc)] for doc in passage['docs']))
+    return [Document(page_content=passage['text'], metadata=passage['metadata']) for passage in passages]
+
+
+def word_set(text):
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def mmr_order(docs, lambda_=MMR_LAMBDA):
+    # Maximal marginal relevance over the ranked candidates: relevance comes from the retrieval rank,
+    # redundancy from word overlap with what is already picked, so near-duplicate chunks sink
+    words = [word_set(doc.page_content) for doc in docs]
+    relevance = [1.0 - rank / len(docs) for rank in range(len(docs))]
+    remaining = list(range(len(docs)))
+    ordered = []
+    while remaining:
+        def score(i):
+            redundancy = max(
+                (len(words[i] & words[j]) / (len(words[i] | words[j]) or 1) for j in ordered),
+                default=0.0
+            )
+            return lambda_ * relevance[i] - (1 - lambda_) * redundancy
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        ordered.append(best)
+    return [docs[i] for i in ordered]
+
+
+def context_cost(docs):
+    return sum(estimate_tokens(passage.page_content) for passage in merge_chunks(docs))
+
+
+def pack_context(docs, token_budget):
+    # Returns (passages for the prompt, the chunks they were built from). The best candidate is always
+    # kept, even over budget, so a small budget never leaves the model without context
+    selected = []
+    for doc in mmr_order(docs):
+        if selected and context_cost(selected + [doc]) > token_budget:
+            continue
+        selected.append(doc)
+    chosen = {id(doc) for doc in selected}
+    return merge_chunks(selected), [doc for doc in docs if id(doc) in chosen]
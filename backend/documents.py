@@ -0,0 +1,9 @@
+class Document:
+    # A chunk of text and its metadata, shaped like langchain's Document. langchain_core takes about half a
+    # second to import, and nothing else from it is needed at request time
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata if metadata is not None else {}
+
+    def __repr__(self):
+        return f"Document(page_content={self.page_content!r}, metadata={self.metadata!r})"
@@ -0,0 +1,172 @@
+import codecs
+import multiprocessing
+import os
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+PDF_PARALLEL_MIN_PAGES = 16
+PDF_PAGES_PER_TASK = 8
+PDF_EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+DOCX_SECTION_SIZE = 4000
+TXT_READ_BLOCK_SIZE = 1024 * 1024
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+_pool = None
+
+
+def get_extraction_pool():
+    global _pool
+    if _pool is None:
+        # spawn keeps the workers from inheriting the server's threads and open database handles
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_EXTRACT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def extract_pdf_page_range(filepath, start, end):
+    # Parsers are imported on first use so importing the app stays fast
+    import PyPDF2
+    with open(filepath, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def iter_pdf_pages(filepath, progress=None):
+    import PyPDF2
+    with open(filepath, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+        if progress:
+            progress(pages_total=num_pages, pages_extracted=0)
+
+        if num_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS < 2:
+            for i, page in enumerate(pdf_reader.pages):
+                yield i, page.extract_text() or ""
+                if progress:
+                    progress(pages_extracted=i + 1)
+            return
+
+    pool = get_extraction_pool()
+    ranges = iter(range(0, num_pages, PDF_PAGES_PER_TASK))
+    pending = deque()
+
+    def submit_next():
+        start = next(ranges, None)
+        if start is not None:
+            end = min(start + PDF_PAGES_PER_TASK, num_pages)
+            pending.append((start, pool.submit(extract_pdf_page_range, filepath, start, end)))
+
+    # Keep a bounded window of ranges in flight so a huge PDF is never held in memory all at once
+    for _ in range(PDF_EXTRACT_WORKERS * 2):
+        submit_next()
+    while pending:
+        start, future = pending.popleft()
+        pages = future.result()
+        submit_next()
+        for offset, text in enumerate(pages):
+            yield start + offset, text
+        if progress:
+            progress(pages_extracted=start + len(pages))
+
+
+def iter_docx_sections(filepath):
+    from docx import Document
+    doc = Document(filepath)
+    section = []
+    size = 0
+    for paragraph in doc.paragraphs:
+        section.append(paragraph.text)
+        size += len(paragraph.text) + 1
+        if size >= DOCX_SECTION_SIZE:
+            yield None, "\n".join(section) + "\n"
+            section = []
+            size = 0
+    if section:
+        yield None, "\n".join(section) + "\n"
+
+
+def iter_txt_sections(filepath, progress=None, block_size=TXT_READ_BLOCK_SIZE):
+    # Read in fixed-size blocks so memory stays flat for multi-GB logs and transcripts
+    total = os.path.getsize(filepath)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    read = 0
+    if progress:
+        progress(bytes_total=total, bytes_read=0)
+    with open(filepath, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            read += len(block)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield None, text
+            if progress:
+                progress(bytes_read=read)
+            if not block:
+                return
+
+
+def iter_document_sections(filepath, ext, progress=None):
+    if ext == 'pdf':
+        return iter_pdf_pages(filepath, progress)
+    if ext == 'docx':
+        return iter_docx_sections(filepath)
+    if ext == 'txt':
+        return iter_txt_sections(filepath, progress)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+
+def iter_document_chunks(sections, text_splitter):
+    # Pages are split on their own so every chunk keeps its page number. Consecutive sections
+    # without a page (txt blocks, docx sections) are one continuous text: the last chunk of each
+    # section may be cut short by the read boundary, so it is carried over and split again with
+    # the next section. The chunk spanning a boundary then overlaps its neighbours like any other
+    carry = ""
+    for page, text in sections:
+        if page is not None:
+            if carry:
+                for chunk in text_splitter.split_text(carry):
+                    yield None, chunk
+                carry = ""
+            for chunk in text_splitter.split_text(text):
+                yield page, chunk
+            continue
+        text = carry + text
+        chunks = text_splitter.split_text(text)
+        if len(chunks) < 2:
+            carry = text
+            continue
+        for chunk in chunks[:-1]:
+            yield None, chunk
+        carry = text[text.rfind(chunks[-1]):]
+    if carry:
+        for chunk in text_splitter.split_text(carry):
+            yield None, chunk
+
+
+def load_parsers():
+    # Used by the app's warm-up so the first upload doesn't pay for the imports
+    import PyPDF2
+    import docx
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive_members(archive_path):
+    # Yields (name, size, open_member) for each regular file; tar archives are read as a stream,
+    # so each member must be consumed before asking for the next one
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size, lambda info=info: archive.open(info)
+        return
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, member.size, lambda member=member: archive.extractfile(member)
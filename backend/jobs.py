@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): the queue assumes it is the only worker process
+    fcntl = None
+
+
+class JobQueue:
+    def __init__(self, store, max_workers=2, lock_path=None, poll_interval=1.0):
+        self.store = store
+        # Called before each job, e.g. to pick up configuration changed by another process
+        self.before_run = None
+        # Called once this process becomes the job runner, e.g. to queue maintenance jobs exactly once
+        self.on_runner_start = None
+        self.handlers = {}
+        self.max_workers = max_workers
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._started = False
+        self._active = set()
+        self._lock_file = None
+        self._lock = threading.Lock()
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._supervise, name='job-supervisor', daemon=True).start()
+
+    def _acquire_runner_lock(self):
+        # With several worker processes only the one holding the lock file runs jobs. The OS releases the
+        # lock however its holder exits, and another worker takes over
+        if self.lock_path is None or fcntl is None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _supervise(self):
+        while not self._acquire_runner_lock():
+            time.sleep(self.poll_interval)
+        # Jobs still marked running were interrupted when the previous runner exited
+        self.store.requeue_running()
+        with self._lock:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-worker')
+        if self.on_runner_start is not None:
+            try:
+                self.on_runner_start()
+            except Exception as e:
+                # A failing hook must not stop this process from running jobs
+                print(f"Job runner start hook failed: {e}")
+        while True:
+            # Jobs submitted by other worker processes only exist in the store
+            for job in self.store.pending():
+                self._dispatch(job['id'])
+            time.sleep(self.poll_interval)
+
+    def _dispatch(self, job_id):
+        with self._lock:
+            if self._executor is None or job_id in self._active:
+                return
+            self._active.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def submit(self, kind, payload):
+        job = self.store.create(kind, payload)
+        # Outside the runner process the job just stays queued in the store until the runner's next poll
+        self._dispatch(job['id'])
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _run(self, job_id):
+        try:
+            if not self.store.claim(job_id):
+                return
+            job = self.store.get(job_id)
+            progress = dict(job['progress'])
+
+            def report(**fields):
+                progress.update(fields)
+                self.store.update(job_id, progress=progress)
+
+            try:
+                if self.before_run is not None:
+                    self.before_run()
+                result = self.handlers[job['kind']](job['payload'], report)
+                self.store.update(job_id, status='completed', result=result)
+            except Exception as e:
+                error_type = 'ollama_connection' if isinstance(e, ConnectionError) else 'processing'
+                self.store.update(job_id, status='failed', error=str(e), error_type=error_type)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
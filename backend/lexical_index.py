@@ -0,0 +1,230 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from documents import Document
+from storage import SQLiteStore
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._\-/][a-z0-9]+)*")
+ID_LIKE_PATTERN = re.compile(r"[a-z]*\d[a-z0-9]*(?:[._\-/][a-z0-9]+)*|[a-z0-9]+(?:[._\-/][a-z0-9]+)+")
+KEYWORD_QUERY_MAX_TOKENS = 4
+RRF_K = 60
+SQLITE_MAX_PARAMS = 500
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        # Compound identifiers like "pn-1203" or "4.2.1" are also indexed by their parts
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[._\-/]", token) if part)
+    return tokens
+
+
+def identifier_terms(question):
+    return [token for token in TOKEN_PATTERN.findall(question.lower()) if ID_LIKE_PATTERN.fullmatch(token)]
+
+
+def is_keyword_query(question):
+    tokens = TOKEN_PATTERN.findall(question.lower())
+    if not tokens or len(tokens) > KEYWORD_QUERY_MAX_TOKENS:
+        return False
+    return bool(identifier_terms(question))
+
+
+def reciprocal_rank_fusion(result_lists, k):
+    scores = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = (doc.metadata.get('doc_id'), doc.metadata.get('chunk'))
+            scores[key] += 1.0 / (RRF_K + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+class LexicalIndex(SQLiteStore):
+    K1 = 1.2
+    B = 0.75
+
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                page INTEGER,
+                length INTEGER NOT NULL,
+                content TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks (doc_id)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, chunk_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_postings_chunk_id ON postings (chunk_id)')
+        conn.execute('CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                chunk_count INTEGER NOT NULL,
+                total_length INTEGER NOT NULL
+            )
+        """)
+        conn.execute('INSERT OR IGNORE INTO stats (id, chunk_count, total_length) VALUES (0, 0, 0)')
+
+    def count(self):
+        return self.connection().execute('SELECT chunk_count FROM stats WHERE id = 0').fetchone()[0]
+
+    def add_chunks(self, texts, metadatas):
+        chunk_rows = []
+        posting_rows = []
+        df_increments = Counter()
+        total_length = 0
+        for text, metadata in zip(texts, metadatas):
+            chunk_id = f"{metadata['doc_id']}:{metadata['chunk']}"
+            term_counts = Counter(tokenize(text))
+            length = sum(term_counts.values())
+            total_length += length
+            chunk_rows.append((
+                chunk_id, metadata['doc_id'], metadata.get('source', 'Unknown'),
+                metadata['chunk'], metadata.get('page'), length, text
+            ))
+            posting_rows.extend((term, chunk_id, tf) for term, tf in term_counts.items())
+            df_increments.update(term_counts.keys())
+
+        with self.connection() as conn:
+            # Adding a chunk that is already indexed replaces it, e.g. when two workers run the same backfill
+            self._remove_chunks(conn, [row[0] for row in chunk_rows])
+            conn.executemany('INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?)', chunk_rows)
+            conn.executemany('INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)', posting_rows)
+            conn.executemany(
+                'INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df',
+                df_increments.items()
+            )
+            conn.execute(
+                'UPDATE stats SET chunk_count = chunk_count + ?, total_length = total_length + ? WHERE id = 0',
+                (len(chunk_rows), total_length)
+            )
+
+    def _remove_chunks(self, conn, chunk_ids):
+        for start in range(0, len(chunk_ids), SQLITE_MAX_PARAMS):
+            batch = chunk_ids[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ','.join('?' * len(batch))
+            removed = conn.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE chunk_id IN ({placeholders})', batch
+            ).fetchone()
+            if not removed[0]:
+                continue
+            df_decrements = conn.execute(
+                f'SELECT term, COUNT(*) FROM postings WHERE chunk_id IN ({placeholders}) GROUP BY term', batch
+            ).fetchall()
+            conn.executemany('UPDATE terms SET df = df - ? WHERE term = ?', [(count, term) for term, count in df_decrements])
+            conn.execute('DELETE FROM terms WHERE df <= 0')
+            conn.execute(f'DELETE FROM postings WHERE chunk_id IN ({placeholders})', batch)
+            conn.execute(f'DELETE FROM chunks WHERE chunk_id IN ({placeholders})', batch)
+            conn.execute(
+                'UPDATE stats SET chunk_count = chunk_count - ?, total_length = total_length - ? WHERE id = 0',
+                removed
+            )
+
+    def delete_document(self, doc_id):
+        with self.connection() as conn:
+            removed = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE doc_id = ?', (doc_id,)
+            ).fetchone()
+            if not removed[0]:
+                return
+            df_decrements = conn.execute("""
+                SELECT term, COUNT(*) FROM postings
+                WHERE chunk_id IN (SELECT chunk_id FROM chunks WHERE doc_id = ?)
+                GROUP BY term
+            """, (doc_id,)).fetchall()
+            conn.executemany('UPDATE terms SET df = df - ? WHERE term = ?', [(count, term) for term, count in df_decrements])
+            conn.execute('DELETE FROM terms WHERE df <= 0')
+            conn.execute('DELETE FROM postings WHERE chunk_id IN (SELECT chunk_id FROM chunks WHERE doc_id = ?)', (doc_id,))
+            conn.execute('DELETE FROM chunks WHERE doc_id = ?', (doc_id,))
+            conn.execute(
+                'UPDATE stats SET chunk_count = chunk_count - ?, total_length = total_length - ? WHERE id = 0',
+                removed
+            )
+
+    def search(self, query, k=3, doc_ids=None, required_terms=None):
+        # With required_terms, only chunks containing at least one of them are returned, so a lookup for an
+        # identifier the corpus doesn't have finds nothing instead of matching on "what" or "is"
+        if doc_ids is not None and not doc_ids:
+            return []
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        conn = self.connection()
+        chunk_count, total_length = conn.execute('SELECT chunk_count, total_length FROM stats WHERE id = 0').fetchone()
+        if not chunk_count:
+            return []
+        avg_length = total_length / chunk_count
+
+        placeholders = ','.join('?' * len(terms))
+        document_frequencies = conn.execute(
+            f'SELECT term, df FROM terms WHERE term IN ({placeholders})', terms
+        ).fetchall()
+
+        # Scoped searches still use corpus-wide idf so scores stay comparable to unscoped ones
+        scope_filter = ''
+        scope_params = []
+        if doc_ids is not None:
+            scope_filter = f" AND c.doc_id IN ({','.join('?' * len(doc_ids))})"
+            scope_params = list(doc_ids)
+
+        candidates = None
+        if required_terms:
+            candidates = {
+                row[0] for row in conn.execute(
+                    f"SELECT p.chunk_id FROM postings p JOIN chunks c ON c.chunk_id = p.chunk_id "
+                    f"WHERE p.term IN ({','.join('?' * len(required_terms))})" + scope_filter,
+                    [*required_terms, *scope_params]
+                )
+            }
+            if not candidates:
+                return []
+
+        scores = defaultdict(float)
+        for term, df in document_frequencies:
+            idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+            rows = conn.execute(
+                'SELECT p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term = ?'
+                + scope_filter,
+                [term, *scope_params]
+            )
+            for chunk_id, tf, length in rows:
+                if candidates is not None and chunk_id not in candidates:
+                    continue
+                norm = self.K1 * (1 - self.B + self.B * length / avg_length)
+                scores[chunk_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        if not top:
+            return []
+        chunk_ids = [chunk_id for chunk_id, _ in top]
+        rows = {
+            row['chunk_id']: row
+            for row in conn.execute(
+                f"SELECT * FROM chunks WHERE chunk_id IN ({','.join('?' * len(chunk_ids))})", chunk_ids
+            )
+        }
+        docs = []
+        for chunk_id in chunk_ids:
+            row = rows[chunk_id]
+            metadata = {"source": row['source'], "doc_id": row['doc_id'], "chunk": row['chunk']}
+            if row['page'] is not None:
+                metadata['page'] = row['page']
+            docs.append(Document(page_content=row['content'], metadata=metadata))
+        return docs
@@ -0,0 +1,180 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Lower runs first; interactive requests jump ahead of queued batch work
+PRIORITIES = {'interactive': 0, 'batch': 1}
+
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class QueueTimeout(SchedulerBusy):
+    pass
+
+
+class Generation:
+    # One LLM call, shared by every request that asked for the same prompt while it was queued or running
+    def __init__(self, key, produce, priority, lock):
+        self.key = key
+        self.produce = produce
+        self.priority = priority
+        self.tokens = []
+        self.subscribers = 0
+        self.state = 'queued'
+        self.error = None
+        self.enqueued = time.monotonic()
+        self.changed = threading.Condition(lock)
+
+
+class GenerationScheduler:
+    # At most max_concurrency generations run at once; the rest wait in a bounded priority queue. A request
+    # that can't start within its priority's queue timeout fails fast instead of adding to everyone's latency
+    def __init__(self, max_concurrency=2, max_queue=64, queue_timeouts=None, wait_histogram=None, outcomes=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeouts = queue_timeouts or {'interactive': 30, 'batch': 300}
+        self.wait_histogram = wait_histogram
+        self.outcomes = outcomes
+        self._heap = []
+        self._order = itertools.count()
+        self._in_flight = {}
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _count(self, result):
+        if self.outcomes is not None:
+            self.outcomes.inc(result=result)
+
+    def set_concurrency(self, max_concurrency):
+        with self._lock:
+            self.max_concurrency = max_concurrency
+            self._pump()
+
+    def _push(self, generation):
+        heapq.heappush(self._heap, (PRIORITIES[generation.priority], next(self._order), generation))
+
+    def _pump(self):
+        # Called with the lock held whenever a slot frees up or work arrives
+        while self._running < self.max_concurrency and self._heap:
+            rank, _, generation = heapq.heappop(self._heap)
+            # Entries left behind by a cancelled or re-prioritized generation are skipped
+            if generation.state != 'queued' or rank != PRIORITIES[generation.priority]:
+                continue
+            self._queued[generation.priority] -= 1
+            generation.state = 'running'
+            self._running += 1
+            if self.wait_histogram is not None:
+                self.wait_histogram.observe(time.monotonic() - generation.enqueued, priority=generation.priority)
+            generation.changed.notify_all()
+            threading.Thread(target=self._execute, args=(generation,), name='llm-generation', daemon=True).start()
+
+    def _execute(self, generation):
+        error = None
+        tokens = generation.produce()
+        try:
+            for token in tokens:
+                with self._lock:
+                    if not generation.subscribers:
+                        # Every caller went away (e.g. closed their stream); stop paying for the rest. A new
+                        # request for the same prompt must not join this truncated generation
+                        generation.state = 'cancelled'
+                        del self._in_flight[generation.key]
+                        break
+                    generation.tokens.append(token)
+                    generation.changed.notify_all()
+        except Exception as e:
+            error = e
+        finally:
+            if hasattr(tokens, 'close'):
+                tokens.close()
+            with self._lock:
+                if generation.state == 'running':
+                    generation.state = 'failed' if error is not None else 'done'
+                generation.error = error
+                self._count(generation.state)
+                if self._in_flight.get(generation.key) is generation:
+                    del self._in_flight[generation.key]
+                self._running -= 1
+                generation.changed.notify_all()
+                self._pump()
+
+    def _subscribe(self, key, produce, priority):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        with self._lock:
+            generation = self._in_flight.get(key)
+            if generation is not None:
+                generation.subscribers += 1
+                self._count('coalesced')
+                if generation.state == 'queued' and PRIORITIES[priority] < PRIORITIES[generation.priority]:
+                    self._queued[generation.priority] -= 1
+                    self._queued[priority] += 1
+                    generation.priority = priority
+                    self._push(generation)
+                return generation
+            if sum(self._queued.values()) >= self.max_queue and self._running >= self.max_concurrency:
+                self._count('rejected')
+                raise SchedulerBusy("Too many questions are waiting for the language model; please retry shortly")
+            generation = Generation(key, produce, priority, self._lock)
+            generation.subscribers = 1
+            self._in_flight[key] = generation
+            self._queued[priority] += 1
+            self._push(generation)
+            self._pump()
+            return generation
+
+    def _unsubscribe(self, generation):
+        with self._lock:
+            generation.subscribers -= 1
+            if not generation.subscribers and generation.state == 'queued':
+                generation.state = 'cancelled'
+                self._queued[generation.priority] -= 1
+                if self._in_flight.get(generation.key) is generation:
+                    del self._in_flight[generation.key]
+
+    def stream(self, key, produce, priority='interactive'):
+        # produce() returns an iterator of text tokens; requests with an equal key while it is in flight
+        # share it, each receiving every token from the first
+        generation = self._subscribe(key, produce, priority)
+        deadline = time.monotonic() + self.queue_timeouts[priority]
+        index = 0
+        try:
+            while True:
+                with self._lock:
+                    while index >= len(generation.tokens) and generation.state in ('queued', 'running'):
+                        if generation.state == 'queued':
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                self._count('timed_out')
+                                raise QueueTimeout("Timed out waiting for the language model; please retry shortly")
+                            generation.changed.wait(remaining)
+                        else:
+                            generation.changed.wait()
+                    tokens = generation.tokens[index:]
+                    finished = generation.state not in ('queued', 'running')
+                    error = generation.error
+                index += len(tokens)
+                yield from tokens
+                if finished and index >= len(generation.tokens):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._unsubscribe(generation)
+
+    def generate(self, key, produce, priority='interactive'):
+        return "".join(self.stream(key, produce, priority))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": dict(self._queued),
+                "in_flight": len(self._in_flight)
+            }
@@ -0,0 +1,181 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        values = self.values()
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, ('le', format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return self.register(Counter(name, description, label_names))
+
+    def gauge(self, name, description, label_names=()):
+        return self.register(Gauge(name, description, label_names))
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, label_names, buckets))
+
+    def add_collector(self, collector):
+        # Collectors refresh gauges from live state (cache sizes, queue depths) right before each scrape
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    def collect(self, timings=None):
+        # Stage timings on this thread are also appended to the returned list until stop_collecting()
+        self._local.timings = [] if timings is None else timings
+        return self._local.timings
+
+    def stop_collecting(self):
+        self._local.timings = None
+
+    @contextmanager
+    def time(self, operation, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, stage, time.perf_counter() - started)
+
+    @contextmanager
+    def accumulate(self, totals, stage):
+        # For stages entered many times per operation (e.g. once per batch); record_all() then observes each total once
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals[stage] += time.perf_counter() - started
+
+    def iterate(self, iterable, totals, stage):
+        # Time spent producing each item is added to totals[stage]; the consumer's own time is not
+        iterator = iter(iterable)
+        while True:
+            with self.accumulate(totals, stage):
+                item = next(iterator, None)
+            if item is None:
+                return
+            yield item
+
+    def record_all(self, operation, totals):
+        for stage, seconds in totals.items():
+            self.record(operation, stage, seconds)
+
+    def record(self, operation, stage, seconds):
+        self.histogram.observe(seconds, operation=operation, stage=stage)
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings.append((f"{operation}.{stage}", seconds))
@@ -0,0 +1,134 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+# Failures that mean Ollama itself is unreachable, as opposed to e.g. an unknown model
+UNAVAILABLE_ERRORS = (httpx.TransportError, ConnectionError)
+
+
+class OllamaService:
+    def __init__(self, base_url, max_connections=32, failure_threshold=3, recovery_seconds=10, probe_interval=15):
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.probe_interval = probe_interval
+        self.max_connections = max_connections
+        self._client = None
+        self.last_error = None
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._probe_thread = None
+
+    @property
+    def client(self):
+        # The ollama package is slow to import, so the client is created on first call rather than at startup
+        with self._lock:
+            if self._client is None:
+                import ollama
+                self._client = ollama.Client(
+                    host=self.base_url,
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                    timeout=httpx.Timeout(300, connect=5)
+                )
+            return self._client
+
+    def is_available(self):
+        with self._lock:
+            if self._opened_at is not None and time.monotonic() - self._opened_at < self.recovery_seconds:
+                return False, self.last_error
+            # Closed, or half-open after the recovery window: let the next call through as a trial
+            return True, None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self.last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self._failures += 1
+            self.last_error = str(error) or type(error).__name__
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+    def call(self, method, *args, **kwargs):
+        try:
+            result = getattr(self.client, method)(*args, **kwargs)
+        except UNAVAILABLE_ERRORS as e:
+            self.record_failure(e)
+            raise ConnectionError(str(e)) from e
+        self.record_success()
+        return result
+
+    def generate_stream(self, **kwargs):
+        # The client's stream is lazy: the request is only sent, and can only fail, once it is iterated. Success
+        # is recorded on the first chunk so failed generations count towards opening the breaker
+        succeeded = False
+        try:
+            for part in self.client.generate(stream=True, **kwargs):
+                if not succeeded:
+                    self.record_success()
+                    succeeded = True
+                yield part
+        except UNAVAILABLE_ERRORS as e:
+            self.record_failure(e)
+            raise ConnectionError(str(e)) from e
+
+    def list(self):
+        return self.call('list')
+
+    def probe(self):
+        try:
+            self.list()
+        except Exception:
+            pass
+
+    def start_probe(self):
+        if self._probe_thread is None:
+            self._probe_thread = threading.Thread(target=self._probe_loop, name='ollama-probe', daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while not self._closed.is_set():
+            self.probe()
+            self._closed.wait(self.probe_interval)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._client is not None:
+                self._client._client.close()
+
+
+class OllamaClientEmbeddings:
+    # Same endpoint and instruction prefixes as langchain's OllamaEmbeddings, so existing vectors stay comparable
+    embed_instruction = "passage: "
+    query_instruction = "query: "
+
+    def __init__(self, service, model, max_concurrency=8):
+        self.service = service
+        self.model = model
+        self.max_concurrency = max_concurrency
+
+    def _embed_one(self, prompt):
+        return self.service.call('embeddings', model=self.model, prompt=prompt)['embedding']
+
+    def _embed(self, prompts):
+        if len(prompts) <= 1:
+            return [self._embed_one(prompt) for prompt in prompts]
+        with ThreadPoolExecutor(max_workers=min(len(prompts), self.max_concurrency)) as pool:
+            return list(pool.map(self._embed_one, prompts))
+
+    def embed_documents(self, texts):
+        return self._embed([f"{self.embed_instruction}{text}" for text in texts])
+
+    def embed_query(self, text):
+        return self._embed_one(f"{self.query_instruction}{text}")
+
+    def embed_queries(self, texts):
+        return self._embed([f"{self.query_instruction}{text}" for text in texts])
@@ -0,0 +1,98 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class Pipeline:
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add_stage(self, name, handler, workers=1):
+        # handler(items) consumes an iterator over the previous stage's outputs and yields its own outputs;
+        # with several workers each one runs the handler over the same shared input
+        self.stages.append((name, handler, workers))
+        return self
+
+    def run(self, source):
+        failed = threading.Event()
+        errors = []
+        # Bounded queues between stages: a slow stage applies back-pressure instead of letting work pile up in memory
+        queues = [queue.Queue(self.queue_size) for _ in self.stages]
+        outputs = []
+
+        def put(q, item):
+            while True:
+                if failed.is_set():
+                    raise PipelineAborted()
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def items(q):
+            while True:
+                if failed.is_set():
+                    raise PipelineAborted()
+                try:
+                    item = q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    # Leave the marker for the other workers reading this queue
+                    q.put(_DONE)
+                    return
+                yield item
+
+        def fail(error):
+            if not isinstance(error, PipelineAborted):
+                errors.append(error)
+            failed.set()
+
+        def feed():
+            try:
+                for item in source:
+                    put(queues[0], item)
+                put(queues[0], _DONE)
+            except BaseException as e:
+                fail(e)
+
+        threads = [threading.Thread(target=feed, name='pipeline-source', daemon=True)]
+        for index, (name, handler, workers) in enumerate(self.stages):
+            remaining = [workers]
+            lock = threading.Lock()
+            last = index == len(self.stages) - 1
+
+            def work(index=index, handler=handler, remaining=remaining, lock=lock, last=last):
+                try:
+                    for output in handler(items(queues[index])):
+                        if last:
+                            outputs.append(output)
+                        else:
+                            put(queues[index + 1], output)
+                    with lock:
+                        remaining[0] -= 1
+                        finished = remaining[0] == 0
+                    if finished and not last:
+                        put(queues[index + 1], _DONE)
+                except BaseException as e:
+                    fail(e)
+
+            threads.extend(
+                threading.Thread(target=work, name=f'pipeline-{name}-{worker}', daemon=True)
+                for worker in range(workers)
+            )
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return outputs
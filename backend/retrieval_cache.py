@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class RetrievalCache:
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.query_embeddings = LRUCache(max_entries, ttl_seconds)
+        self.results = LRUCache(max_entries, ttl_seconds)
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        # Bumping the generation orphans every cached result; clearing just frees the memory early
+        with self._lock:
+            self.generation += 1
+        self.results.clear()
+
+    def result_key(self, model, question, k, scope=None):
+        return (model, normalize_question(question), k, scope, self.generation)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "query_embeddings": self.query_embeddings.stats(),
+            "results": self.results.stats()
+        }
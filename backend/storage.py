@@ -0,0 +1,375 @@
+import base64
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            self.create_schema(conn)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def create_schema(self, conn):
+        pass
+
+
+class JobStore(SQLiteStore):
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                error_type TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+
+    def _row_to_job(self, row):
+        return {
+            "id": row['id'],
+            "kind": row['kind'],
+            "status": row['status'],
+            "payload": json.loads(row['payload']),
+            "progress": json.loads(row['progress']),
+            "result": json.loads(row['result']) if row['result'] else None,
+            "error": row['error'],
+            "error_type": row['error_type'],
+            "created_at": row['created_at'],
+            "updated_at": row['updated_at']
+        }
+
+    def create(self, kind, payload):
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, payload, progress, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, 'queued', json.dumps(payload), '{}', now, now)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        row = self.connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def pending(self, kind=None):
+        query = "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+        params = []
+        if kind is not None:
+            query += ' AND kind = ?'
+            params.append(kind)
+        rows = self.connection().execute(query + ' ORDER BY created_at', params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def requeue_running(self):
+        with self.connection() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+
+    def claim(self, job_id):
+        with self.connection() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (datetime.now().isoformat(), job_id)
+            ).rowcount > 0
+
+    def update(self, job_id, **fields):
+        for key in ('payload', 'progress', 'result'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        fields['updated_at'] = datetime.now().isoformat()
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self.connection() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', [*fields.values(), job_id])
+
+
+class ConversationStore(SQLiteStore):
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at)')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)')
+
+    def _row_to_summary(self, row):
+        return {
+            "id": row['id'],
+            "title": row['title'],
+            "message_count": row['message_count'],
+            "created_at": row['created_at'],
+            "updated_at": row['updated_at']
+        }
+
+    def add_message(self, conversation_id, qa_entry):
+        conversation_id = conversation_id or str(uuid.uuid4())
+        timestamp = qa_entry['timestamp']
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO conversations (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                (conversation_id, qa_entry['question'][:100], timestamp, timestamp)
+            )
+            conn.execute(
+                'INSERT INTO messages (conversation_id, question, answer, sources, timestamp) VALUES (?, ?, ?, ?, ?)',
+                (conversation_id, qa_entry['question'], qa_entry['answer'], json.dumps(qa_entry['sources']), timestamp)
+            )
+            conn.execute(
+                'UPDATE conversations SET message_count = message_count + 1, updated_at = ? WHERE id = ?',
+                (timestamp, conversation_id)
+            )
+        return conversation_id
+
+    def get(self, conversation_id):
+        conn = self.connection()
+        row = conn.execute('SELECT * FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        conversation = self._row_to_summary(row)
+        conversation['messages'] = [
+            {
+                "question": message['question'],
+                "answer": message['answer'],
+                "sources": json.loads(message['sources']),
+                "timestamp": message['timestamp']
+            }
+            for message in conn.execute(
+                'SELECT * FROM messages WHERE conversation_id = ? ORDER BY id', (conversation_id,)
+            )
+        ]
+        return conversation
+
+    def list(self, limit=50, offset=0):
+        rows = self.connection().execute(
+            'SELECT * FROM conversations ORDER BY updated_at DESC, id LIMIT ? OFFSET ?', (limit, offset)
+        ).fetchall()
+        return [self._row_to_summary(row) for row in rows]
+
+    def count(self):
+        return self.connection().execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+
+    def delete(self, conversation_id):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+            conn.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+
+    def import_conversations(self, conversations):
+        with self.connection() as conn:
+            for conversation in conversations:
+                messages = conversation.get('messages', [])
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO conversations (id, title, message_count, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        conversation['id'],
+                        messages[0]['question'][:100] if messages else '',
+                        len(messages),
+                        conversation['created_at'],
+                        conversation['updated_at']
+                    )
+                ).rowcount
+                if not inserted:
+                    continue
+                conn.executemany(
+                    'INSERT INTO messages (conversation_id, question, answer, sources, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (conversation['id'], m['question'], m['answer'], json.dumps(m.get('sources', [])), m.get('timestamp', conversation['updated_at']))
+                        for m in messages
+                    ]
+                )
+
+
+class DocumentStore(SQLiteStore):
+    SORT_COLUMNS = {'uploaded_at', 'filename'}
+    LIST_COLUMNS = 'id, filename, chunks, filepath, folder, uploaded_at'
+
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                chunks INTEGER NOT NULL,
+                filepath TEXT NOT NULL,
+                folder TEXT,
+                uploaded_at TEXT NOT NULL,
+                text_preview TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_documents_uploaded_at ON documents (uploaded_at, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents (folder, uploaded_at, id)')
+
+    def add(self, doc):
+        self.add_many([doc])
+
+    def add_many(self, docs):
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO documents (id, filename, chunks, filepath, folder, uploaded_at, text_preview) '
+                'VALUES (:id, :filename, :chunks, :filepath, :folder, :uploaded_at, :text_preview)',
+                docs
+            )
+
+    def get(self, doc_id):
+        row = self.connection().execute('SELECT * FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, doc_id):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+
+    def set_folder(self, doc_id, folder):
+        with self.connection() as conn:
+            return conn.execute('UPDATE documents SET folder = ? WHERE id = ?', (folder, doc_id)).rowcount > 0
+
+    def count(self):
+        return self.connection().execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def list(self, folder=None, sort='uploaded_at', descending=True, limit=50, cursor=None):
+        if sort not in self.SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort field: {sort}")
+        direction = 'DESC' if descending else 'ASC'
+        conditions = []
+        params = []
+        if folder is not None:
+            conditions.append('folder = ?')
+            params.append(folder)
+        if cursor:
+            conditions.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.connection().execute(
+            f'SELECT {self.LIST_COLUMNS} FROM documents {where} ORDER BY {sort} {direction}, id {direction} LIMIT ?',
+            [*params, limit + 1]
+        ).fetchall()
+        docs = [dict(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(docs[-1][sort], docs[-1]['id']) if len(rows) > limit else None
+        return docs, next_cursor
+
+    def ids_in_folder(self, folder):
+        rows = self.connection().execute('SELECT id FROM documents WHERE folder = ?', (folder,)).fetchall()
+        return [row['id'] for row in rows]
+
+    def folder_counts(self):
+        rows = self.connection().execute(
+            'SELECT folder, COUNT(*) AS count FROM documents WHERE folder IS NOT NULL GROUP BY folder ORDER BY folder'
+        ).fetchall()
+        return {row['folder']: row['count'] for row in rows}
+
+    def import_documents(self, documents):
+        self.add_many([
+            {
+                "id": doc['id'],
+                "filename": doc['filename'],
+                "chunks": doc.get('chunks', 0),
+                "filepath": doc.get('filepath', ''),
+                "folder": doc.get('folder'),
+                "uploaded_at": doc.get('uploaded_at', datetime.now().isoformat()),
+                "text_preview": doc.get('text_preview', '')
+            }
+            for doc in documents
+        ])
+
+
+class SharedStateStore(SQLiteStore):
+    # State every worker process has to agree on: versioned settings, and a log of document changes
+    # that each worker replays to invalidate its in-memory caches
+    CHANGE_LOG_RETENTION = 10000
+
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute('CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT)')
+
+    def get_setting(self, name):
+        # Returns (value, version); version 0 means the setting was never saved
+        row = self.connection().execute('SELECT value, version FROM settings WHERE name = ?', (name,)).fetchone()
+        return (json.loads(row['value']), row['version']) if row else (None, 0)
+
+    def setting_version(self, name):
+        row = self.connection().execute('SELECT version FROM settings WHERE name = ?', (name,)).fetchone()
+        return row['version'] if row else 0
+
+    def save_setting(self, name, value, expected_version):
+        # Compare-and-set: returns the new version, or None if another process saved it first
+        with self.connection() as conn:
+            if expected_version == 0:
+                saved = conn.execute(
+                    'INSERT OR IGNORE INTO settings (name, value, version) VALUES (?, ?, 1)', (name, json.dumps(value))
+                ).rowcount
+            else:
+                saved = conn.execute(
+                    'UPDATE settings SET value = ?, version = version + 1 WHERE name = ? AND version = ?',
+                    (json.dumps(value), name, expected_version)
+                ).rowcount
+        return expected_version + 1 if saved else None
+
+    def record_change(self, doc_id=None):
+        # doc_id=None records a change that affects search results but no particular cited document
+        with self.connection() as conn:
+            seq = conn.execute('INSERT INTO changes (doc_id) VALUES (?)', (doc_id,)).lastrowid
+            if seq % 1000 == 0:
+                conn.execute('DELETE FROM changes WHERE seq <= ?', (seq - self.CHANGE_LOG_RETENTION,))
+        return seq
+
+    def latest_change(self):
+        row = self.connection().execute('SELECT MAX(seq) FROM changes').fetchone()
+        return row[0] or 0
+
+    def changes_since(self, seq):
+        # Returns (latest seq, doc ids changed after seq, complete); complete is False when the log was
+        # pruned past seq, so the caller can't know every document that changed
+        rows = self.connection().execute('SELECT seq, doc_id FROM changes WHERE seq > ? ORDER BY seq', (seq,)).fetchall()
+        if not rows:
+            return seq, set(), True
+        return rows[-1]['seq'], {row['doc_id'] for row in rows}, rows[0]['seq'] == seq + 1
+
+
+def encode_cursor(sort_value, doc_id):
+    return base64.urlsafe_b64encode(json.dumps([sort_value, doc_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return sort_value, doc_id
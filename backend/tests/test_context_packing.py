@@ -0,0 +1,49 @@
+import random
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from context_packing import merge_chunks
+from documents import Document
+
+VOCABULARY = (
+    "approval request documents section policy review access the a of to and is in should must report 2 3 data "
+    "system user"
+).split()
+
+
+def chunk_docs(chunks, first=0):
+    return [Document(page_content=text, metadata={"doc_id": "doc", "chunk": first + i}) for i, text in enumerate(chunks)]
+
+
+def squash(text):
+    return " ".join(text.split())
+
+
+def test_merging_splitter_output_never_corrupts_text():
+    # Paragraphs longer than the overlap and without closing punctuation, as in headings and lists, give
+    # neighbouring chunks with no overlap whose edges can still match by coincidence
+    rng = random.Random(0)
+    text = "\n\n".join(" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 160))) for _ in range(80))
+    chunks = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len).split_text(text)
+    for i in range(len(chunks) - 1):
+        merged = merge_chunks(chunk_docs(chunks[i:i + 2], first=i))[0].page_content
+        # Either the overlap was removed exactly, or the chunks were kept whole
+        assert squash(merged) in squash(text) or merged == chunks[i] + "\n" + chunks[i + 1]
+
+
+def test_short_coincidental_match_is_not_treated_as_overlap():
+    merged = merge_chunks(chunk_docs(["Please read the documents", "section 2 covers access"]))
+    assert merged[0].page_content == "Please read the documents\nsection 2 covers access"
+
+
+def test_repeated_word_is_kept():
+    merged = merge_chunks(chunk_docs(["Submit it for approval approval", "approval request forms go to review"]))
+    assert merged[0].page_content == "Submit it for approval approval\napproval request forms go to review"
+
+
+def test_splitter_overlap_is_removed():
+    left = "The security office issues badges. Lost badges must be reported within one day."
+    right = "Lost badges must be reported within one day. Replacements take a week."
+    merged = merge_chunks(chunk_docs([left, right]))
+    assert merged[0].page_content == (
+        "The security office issues badges. Lost badges must be reported within one day. Replacements take a week."
+    )
@@ -0,0 +1,45 @@
+from lexical_index import LexicalIndex, identifier_terms, is_keyword_query
+
+
+def make_index(tmp_path):
+    index = LexicalIndex(str(tmp_path / 'lexical_index.db'))
+    texts = [
+        "What is the policy for badge access? Badges are issued by the security office.",
+        "Part PN-1203 is the replacement filter for the intake assembly.",
+        "Expense reports are due within 30 days of travel."
+    ]
+    index.add_chunks(texts, [{"doc_id": "doc", "chunk": i, "source": "handbook.txt"} for i in range(len(texts))])
+    return index
+
+
+def test_keyword_query_detects_identifiers():
+    assert is_keyword_query("PN-1203")
+    assert is_keyword_query("What is 401k?")
+    assert not is_keyword_query("What is the badge policy?")
+    assert identifier_terms("What is 401k?") == ["401k"]
+
+
+def test_identifier_lookup_finds_chunk(tmp_path):
+    index = make_index(tmp_path)
+    results = index.search("pn-1203", k=3, required_terms=identifier_terms("pn-1203"))
+    assert [doc.metadata['chunk'] for doc in results] == [1]
+
+
+def test_missing_identifier_finds_nothing(tmp_path):
+    index = make_index(tmp_path)
+    # Without the requirement, "what" and "is" match the first chunk
+    assert index.search("What is 401k?", k=3)
+    assert index.search("What is 401k?", k=3, required_terms=identifier_terms("What is 401k?")) == []
+
+
+def test_adding_a_chunk_again_replaces_it(tmp_path):
+    index = make_index(tmp_path)
+    conn = index.connection()
+    stats = conn.execute('SELECT chunk_count, total_length FROM stats').fetchone()
+    index.add_chunks(
+        ["Part PN-1203 is the replacement filter for the intake assembly."],
+        [{"doc_id": "doc", "chunk": 1, "source": "handbook.txt"}]
+    )
+    assert conn.execute('SELECT chunk_count, total_length FROM stats').fetchone() == stats
+    assert conn.execute("SELECT df FROM terms WHERE term = 'pn-1203'").fetchone()[0] == 1
+    assert [doc.metadata['chunk'] for doc in index.search("pn-1203", k=3)] == [1]
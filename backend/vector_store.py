@@ -0,0 +1,503 @@
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from storage import SQLiteStore
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): the index assumes a single writing process
+    fcntl = None
+
+NUMPY_INDEX_DTYPES = ('float16', 'int8')
+INITIAL_CAPACITY = 1024
+# Rows scanned per matrix multiply; bounds the float32 working copy (8192 x 768 dims is about 25MB)
+SEARCH_BLOCK_ROWS = 8192
+SQLITE_MAX_PARAMS = 500
+COMPACT_MIN_DEAD_ROWS = 10000
+
+
+def batched(items, size=SQLITE_MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ChromaVectorStore:
+    # The calls the app makes on its vector store, backed by a Chroma collection
+    def __init__(self, client, collection_name, embeddings):
+        self.client = client
+        self.embeddings = embeddings
+        self.collection = client.get_or_create_collection(name=collection_name, embedding_function=None)
+
+    def count(self):
+        return self.collection.count()
+
+    def get(self, doc_id, limit=None, offset=None):
+        return self.collection.get(
+            where={"doc_id": doc_id}, include=['documents', 'metadatas'], limit=limit, offset=offset
+        )
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def update_metadatas(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def delete_document(self, doc_id):
+        self.collection.delete(where={"doc_id": doc_id})
+
+    def query(self, query_embeddings, n_results, doc_ids=None):
+        response = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where={"doc_id": {"$in": doc_ids}} if doc_ids is not None else None,
+            include=['documents', 'metadatas']
+        )
+        # An embedded Chroma database opened by several processes can return ids another process deleted,
+        # with no document behind them
+        results = [
+            [(document, metadata) for document, metadata in zip(documents, metadatas) if document is not None]
+            for documents, metadatas in zip(response['documents'], response['metadatas'])
+        ]
+        return {
+            "documents": [[document for document, _ in result] for result in results],
+            "metadatas": [[metadata for _, metadata in result] for result in results]
+        }
+
+    def drop(self):
+        self.client.delete_collection(self.collection.name)
+
+
+class MigratingVectorStore:
+    # While an embedding migration runs: reads and the embeddings callers use come from the live store,
+    # and every write is mirrored into the shadow store, with new text re-embedded by the shadow's model
+    def __init__(self, live, shadow):
+        self.live = live
+        self.shadow = shadow
+        self.embeddings = live.embeddings
+
+    def count(self):
+        return self.live.count()
+
+    def get(self, doc_id, limit=None, offset=None):
+        return self.live.get(doc_id, limit=limit, offset=offset)
+
+    def query(self, query_embeddings, n_results, doc_ids=None):
+        return self.live.query(query_embeddings, n_results, doc_ids=doc_ids)
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.live.upsert(ids, embeddings, documents, metadatas)
+        self.shadow.upsert(ids, self.shadow.embeddings.embed_documents(documents), documents, metadatas)
+
+    def update_metadatas(self, ids, metadatas):
+        self.live.update_metadatas(ids, metadatas)
+        self.shadow.update_metadatas(ids, metadatas)
+
+    def delete(self, ids):
+        self.live.delete(ids)
+        self.shadow.delete(ids)
+
+    def delete_document(self, doc_id):
+        self.live.delete_document(doc_id)
+        self.shadow.delete_document(doc_id)
+
+
+class VectorRowStore(SQLiteStore):
+    # Text, metadata and the vector row number of every chunk in a NumpyVectorStore
+    def create_schema(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                doc_id TEXT NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks (doc_id)')
+        conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def settings(self):
+        return {row['key']: row['value'] for row in self.connection().execute('SELECT key, value FROM settings')}
+
+    def increment(self, conn, key):
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (key,)
+        )
+
+
+class NumpyVectorStore:
+    # Vectors live in memory-mapped files, quantized to float16, or to int8 with a per-row scale, and are
+    # searched by a blockwise brute-force L2 scan (the same distance Chroma uses). Only a one-byte "alive"
+    # flag per row is held in memory; text and metadata stay in SQLite until a result needs them.
+    # Several processes can share one index: SQLite is the source of truth, writers hold a lock file, and
+    # each process catches up with the others' writes (counted by "version" in settings) before using it.
+    def __init__(self, path, embeddings, dtype='int8'):
+        if dtype not in NUMPY_INDEX_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.embeddings = embeddings
+        self.rows = VectorRowStore(os.path.join(path, 'chunks.db'))
+        self.dtype = dtype
+        self.dim = None
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._row_info = None
+        self._capacity = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._next_row = 0
+        self._dead_rows = 0
+        self._version = None
+        self._deletes = None
+
+        with self._writing() as conn:
+            settings = self.rows.settings()
+            if 'dtype' in settings and settings['dtype'] != dtype:
+                if self.count():
+                    raise ValueError(f"Vector index at {path} was built with {settings['dtype']} vectors, not {dtype}")
+                # Empty index: start over with the new dtype; the old files go with the old generation
+                with conn:
+                    conn.execute("DELETE FROM settings WHERE key IN ('dim', 'dtype')")
+                    conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('generation', ?)", (str(self.generation + 1),))
+                    self._bump(conn)
+                self._refresh()
+            self._remove_stale_files()
+
+    @contextmanager
+    def _writing(self):
+        # Thread lock, then the cross-process lock file, then catch up with other processes' writes
+        with self._lock:
+            lock_file = open(os.path.join(self.path, 'write.lock'), 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                yield self.rows.connection()
+            finally:
+                lock_file.close()
+
+    def _bump(self, conn, deleted=False):
+        # Called inside a write transaction while holding the lock, so this process stays caught up
+        self.rows.increment(conn, 'version')
+        self._version += 1
+        if deleted:
+            self.rows.increment(conn, 'deletes')
+            self._deletes += 1
+
+    def _refresh(self):
+        conn = self.rows.connection()
+        # One read transaction, so the settings and the rows come from the same snapshot
+        conn.execute('BEGIN')
+        try:
+            settings = self.rows.settings()
+            version = int(settings.get('version', 0))
+            if version == self._version:
+                return
+            deletes = int(settings.get('deletes', 0))
+            generation = int(settings.get('generation', 0))
+            if 'dim' not in settings:
+                self.dim = None
+                self.generation = generation
+                self._vectors = self._row_info = None
+                self._capacity = self._next_row = self._dead_rows = 0
+                self._alive = np.zeros(0, dtype=bool)
+            elif self._vectors is None or generation != self.generation or deletes != self._deletes:
+                self.dim = int(settings['dim'])
+                self.generation = generation
+                self._open_files()
+            else:
+                # Only rows were appended (or overwritten in place) since the last look
+                appended = [row[0] for row in conn.execute('SELECT row FROM chunks WHERE row >= ?', (self._next_row,))]
+                if appended:
+                    self._next_row = max(appended) + 1
+                    self._ensure_capacity(self._next_row)
+                    self._alive[appended] = True
+            self._version = version
+            self._deletes = deletes
+        finally:
+            conn.execute('COMMIT')
+
+    def _file(self, kind, generation=None):
+        # Files are named by generation; compaction writes a new generation and switches to it in one SQLite commit
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"{kind}.{generation}.bin")
+
+    def _map(self, kind, dtype, columns, capacity, generation=None):
+        path = self._file(kind, generation)
+        size = capacity * columns * np.dtype(dtype).itemsize
+        with open(path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity, columns))
+
+    def _open_files(self):
+        existing = self._file('vectors')
+        row_bytes = self.dim * np.dtype(self.dtype).itemsize
+        capacity = max(INITIAL_CAPACITY, os.path.getsize(existing) // row_bytes if os.path.exists(existing) else 0)
+        self._vectors = self._map('vectors', self.dtype, self.dim, capacity)
+        # Per row: dequantization scale and squared norm of the stored vector
+        self._row_info = self._map('rowinfo', 'float32', 2, capacity)
+        self._capacity = capacity
+        alive = np.zeros(capacity, dtype=bool)
+        rows = [row[0] for row in self.rows.connection().execute('SELECT row FROM chunks')]
+        if rows:
+            alive[rows] = True
+        self._alive = alive
+        self._next_row = max(rows) + 1 if rows else 0
+        self._dead_rows = self._next_row - len(rows)
+
+    def _remove_stale_files(self):
+        current = {f"vectors.{self.generation}.bin", f"rowinfo.{self.generation}.bin"}
+        for name in os.listdir(self.path):
+            if name.endswith('.bin') and name not in current:
+                os.remove(os.path.join(self.path, name))
+
+    def _ensure_capacity(self, rows_needed):
+        if rows_needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < rows_needed:
+            capacity *= 2
+        self._vectors.flush()
+        self._row_info.flush()
+        self._vectors = self._map('vectors', self.dtype, self.dim, capacity)
+        self._row_info = self._map('rowinfo', 'float32', 2, capacity)
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - self._capacity, dtype=bool)])
+        self._capacity = capacity
+
+    def _quantize(self, vectors):
+        if self.dtype == 'int8':
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            restored = quantized.astype(np.float32) * scales[:, None]
+        else:
+            quantized = vectors.astype(np.float16)
+            scales = np.ones(len(vectors), dtype=np.float32)
+            restored = quantized.astype(np.float32)
+        return quantized, scales, np.einsum('ij,ij->i', restored, restored)
+
+    def count(self):
+        return self.rows.connection().execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def get(self, doc_id, limit=None, offset=None):
+        rows = self.rows.connection().execute(
+            'SELECT chunk_id, document, metadata FROM chunks WHERE doc_id = ? ORDER BY row LIMIT ? OFFSET ?',
+            (doc_id, -1 if limit is None else limit, offset or 0)
+        ).fetchall()
+        return {
+            "ids": [row['chunk_id'] for row in rows],
+            "documents": [row['document'] for row in rows],
+            "metadatas": [json.loads(row['metadata']) for row in rows]
+        }
+
+    def _rows_for_ids(self, conn, ids):
+        found = {}
+        for batch in batched(ids):
+            placeholders = ','.join('?' * len(batch))
+            for row in conn.execute(f'SELECT chunk_id, row FROM chunks WHERE chunk_id IN ({placeholders})', batch):
+                found[row['chunk_id']] = row['row']
+        return found
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._writing() as conn:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', [
+                        ('dim', str(self.dim)), ('dtype', self.dtype), ('generation', str(self.generation))
+                    ])
+                    self._bump(conn)
+                self._open_files()
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+            # Existing chunk ids are overwritten in place; new ones are appended
+            existing = self._rows_for_ids(conn, ids)
+            rows = []
+            for chunk_id in ids:
+                if chunk_id in existing:
+                    rows.append(existing[chunk_id])
+                else:
+                    existing[chunk_id] = self._next_row
+                    rows.append(self._next_row)
+                    self._next_row += 1
+            self._ensure_capacity(self._next_row)
+
+            quantized, scales, norms = self._quantize(vectors)
+            self._vectors[rows] = quantized
+            self._row_info[rows, 0] = scales
+            self._row_info[rows, 1] = norms
+            # Vectors reach disk before the rows that point at them are committed
+            self._vectors.flush()
+            self._row_info.flush()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO chunks (chunk_id, row, doc_id, document, metadata) VALUES (?, ?, ?, ?, ?)', [
+                    (chunk_id, row, metadata['doc_id'], document, json.dumps(metadata))
+                    for chunk_id, row, document, metadata in zip(ids, rows, documents, metadatas)
+                ])
+                self._bump(conn)
+            self._alive[rows] = True
+
+    def update_metadatas(self, ids, metadatas):
+        # Rows don't move, so other processes need no refresh
+        with self._writing() as conn, conn:
+            conn.executemany('UPDATE chunks SET metadata = ? WHERE chunk_id = ?', [
+                (json.dumps(metadata), chunk_id) for chunk_id, metadata in zip(ids, metadatas)
+            ])
+
+    def _drop_rows(self, rows):
+        if rows:
+            self._alive[rows] = False
+            self._dead_rows += len(rows)
+            if self._dead_rows >= COMPACT_MIN_DEAD_ROWS and self._dead_rows > self._next_row // 2:
+                self._compact(self.rows.connection())
+
+    def delete(self, ids):
+        with self._writing() as conn:
+            rows = list(self._rows_for_ids(conn, ids).values())
+            with conn:
+                for batch in batched(ids):
+                    conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch)
+                self._bump(conn, deleted=True)
+            self._drop_rows(rows)
+
+    def delete_document(self, doc_id):
+        with self._writing() as conn:
+            rows = [row[0] for row in conn.execute('SELECT row FROM chunks WHERE doc_id = ?', (doc_id,))]
+            with conn:
+                conn.execute('DELETE FROM chunks WHERE doc_id = ?', (doc_id,))
+                self._bump(conn, deleted=True)
+            self._drop_rows(rows)
+
+    def compact(self):
+        with self._writing() as conn:
+            if self.dim is not None:
+                self._compact(conn)
+
+    def _compact(self, conn):
+        # Copies live rows, in order, into a new generation of files and renumbers them in the same commit
+        # that switches generations, so a crash leaves either the old index or the new one
+        old_rows = np.flatnonzero(self._alive[:self._next_row])
+        generation = self.generation + 1
+        capacity = max(INITIAL_CAPACITY, len(old_rows) * 2)
+        vectors = self._map('vectors', self.dtype, self.dim, capacity, generation)
+        row_info = self._map('rowinfo', 'float32', 2, capacity, generation)
+        for start in range(0, len(old_rows), SEARCH_BLOCK_ROWS):
+            block = old_rows[start:start + SEARCH_BLOCK_ROWS]
+            vectors[start:start + len(block)] = self._vectors[block]
+            row_info[start:start + len(block)] = self._row_info[block]
+        vectors.flush()
+        row_info.flush()
+        with conn:
+            # Ascending order never collides: each row moves to a number no higher than its own
+            conn.executemany('UPDATE chunks SET row = ? WHERE row = ?', [
+                (new_row, int(old_row)) for new_row, old_row in enumerate(old_rows)
+            ])
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('generation', ?)", (str(generation),))
+            self._bump(conn)
+        self.generation = generation
+        self._vectors = vectors
+        self._row_info = row_info
+        self._capacity = capacity
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._alive[:len(old_rows)] = True
+        self._next_row = len(old_rows)
+        self._dead_rows = 0
+        self._remove_stale_files()
+
+    def _candidate_rows(self, doc_ids):
+        if doc_ids is None:
+            return np.flatnonzero(self._alive[:self._next_row])
+        rows = []
+        conn = self.rows.connection()
+        for batch in batched(list(doc_ids)):
+            placeholders = ','.join('?' * len(batch))
+            rows.extend(row[0] for row in conn.execute(f'SELECT row FROM chunks WHERE doc_id IN ({placeholders})', batch))
+        # Rows another process appended after the last refresh are picked up by the next one
+        rows = np.array(rows, dtype=np.int64)
+        return np.sort(rows[rows < self._next_row])
+
+    def query(self, query_embeddings, n_results, doc_ids=None):
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        while True:
+            with self._lock:
+                self._refresh()
+                if self.dim is None:
+                    return {"documents": [[] for _ in queries], "metadatas": [[] for _ in queries]}
+                # Growth and compaction swap in new arrays rather than changing these, so the scan can run unlocked
+                generation = self.generation
+                vectors, row_info = self._vectors, self._row_info
+                candidates = self._candidate_rows(doc_ids)
+            best_rows = self._scan(queries, n_results, vectors, row_info, candidates)
+            with self._lock:
+                # Compaction renumbers rows; rows found before it no longer point at the same chunks
+                if generation == self.generation:
+                    result = self._fetch(best_rows, generation)
+                    if result is not None:
+                        return result
+
+    def _scan(self, queries, n_results, vectors, row_info, candidates):
+        best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(candidates), SEARCH_BLOCK_ROWS):
+            rows = candidates[start:start + SEARCH_BLOCK_ROWS]
+            if rows[-1] - rows[0] + 1 == len(rows):
+                block = slice(rows[0], rows[-1] + 1)
+            else:
+                block = rows
+            block_vectors = np.asarray(vectors[block], dtype=np.float32)
+            info = np.asarray(row_info[block])
+            # ||v - q||^2 without the ||q||^2 term, which is the same for every row
+            distances = info[:, 1][None, :] - 2 * (queries @ block_vectors.T) * info[:, 0][None, :]
+            distances = np.concatenate([best_distances, distances], axis=1)
+            all_rows = np.concatenate([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))], axis=1)
+            keep = min(n_results, distances.shape[1])
+            top = np.argpartition(distances, keep - 1, axis=1)[:, :keep]
+            best_distances = np.take_along_axis(distances, top, axis=1)
+            best_rows = np.take_along_axis(all_rows, top, axis=1)
+
+        order = np.argsort(best_distances, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1)
+
+    def drop(self):
+        with self._lock:
+            self._vectors = self._row_info = None
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def _fetch(self, best_rows, generation):
+        # Returns None if another process compacted the index since the scan
+        wanted = sorted({int(row) for row in best_rows.ravel()})
+        found = {}
+        conn = self.rows.connection()
+        conn.execute('BEGIN')
+        try:
+            if int(self.rows.settings().get('generation', 0)) != generation:
+                return None
+            for batch in batched(wanted):
+                placeholders = ','.join('?' * len(batch))
+                for row in conn.execute(f'SELECT row, document, metadata FROM chunks WHERE row IN ({placeholders})', batch):
+                    found[row['row']] = (row['document'], json.loads(row['metadata']))
+        finally:
+            conn.execute('COMMIT')
+        # A row deleted after the scan is simply left out
+        results = [[found[int(row)] for row in query_rows if int(row) in found] for query_rows in best_rows]
+        return {
+            "documents": [[document for document, _ in result] for result in results],
+            "metadatas": [[metadata for _, metadata in result] for result in results]
+        }
@@ -17,7 +17,7 @@ function App() {
 
   const checkDocuments = async () => {
     try {
-      const response = await axios.get(`${API_URL}/documents`);
+      const response = await axios.get(`${API_URL}/documents`, { params: { limit: 1 } });
       setHasDocuments(response.data.documents.length > 0);
     } catch (err) {
       console.error('Failed to check documents:', err);
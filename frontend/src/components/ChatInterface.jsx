@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 
 const API_URL = '/api';
+const CONVERSATIONS_PAGE_SIZE = 50;
 
 const ChatInterface = ({ hasDocuments }) => {
   const [messages, setMessages] = useState([]);
@@ -9,16 +10,22 @@ const ChatInterface = ({ hasDocuments }) => {
   const [loading, setLoading] = useState(false);
   const [currentConversationId, setCurrentConversationId] = useState(null);
   const [conversations, setConversations] = useState([]);
+  const [conversationsTotal, setConversationsTotal] = useState(0);
   const [showHistory, setShowHistory] = useState(false);
 
   useEffect(() => {
     loadConversations();
   }, []);
 
-  const loadConversations = async () => {
+  const loadConversations = async (offset = 0) => {
     try {
-      const response = await axios.get(`${API_URL}/conversations`);
-      setConversations(response.data.conversations);
+      const response = await axios.get(`${API_URL}/conversations`, {
+        params: { limit: CONVERSATIONS_PAGE_SIZE, offset },
+      });
+      setConversations(prev => offset === 0
+        ? response.data.conversations
+        : [...prev, ...response.data.conversations]);
+      setConversationsTotal(response.data.total);
     } catch (err) {
       console.error('Failed to load conversations:', err);
     }
@@ -34,20 +41,65 @@ const ChatInterface = ({ hasDocuments }) => {
     setLoading(true);
 
     try {
-      const response = await axios.post(`${API_URL}/ask`, { 
-        question,
-        conversation_id: currentConversationId 
+      const response = await fetch(`${API_URL}/ask/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          question,
+          conversation_id: currentConversationId
+        }),
       });
-      
-      const assistantMessage = {
-        role: 'assistant',
-        content: response.data.answer,
-        sources: response.data.sources,
+
+      if (!response.ok) {
+        const failure = new Error('Failed to get answer');
+        failure.response = { data: await response.json() };
+        throw failure;
+      }
+
+      setMessages(prev => [...prev, { role: 'assistant', content: '', sources: [] }]);
+      const updateAssistantMessage = (update) => {
+        setMessages(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, ...update(last) }];
+        });
       };
-      
-      setMessages(prev => [...prev, assistantMessage]);
-      setCurrentConversationId(response.data.conversation_id);
-      await loadConversations();
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let doneEvent = null;
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          const eventType = rawEvent.match(/^event: (.*)$/m)?.[1];
+          const dataLine = rawEvent.match(/^data: (.*)$/m)?.[1];
+          if (!eventType || !dataLine) continue;
+          const payload = JSON.parse(dataLine);
+
+          if (eventType === 'sources') {
+            updateAssistantMessage(() => ({ sources: payload.sources }));
+          } else if (eventType === 'token') {
+            updateAssistantMessage(last => ({ content: last.content + payload.token }));
+          } else if (eventType === 'done') {
+            doneEvent = payload;
+          } else if (eventType === 'error') {
+            const failure = new Error(payload.error);
+            failure.response = { data: payload };
+            throw failure;
+          }
+        }
+      }
+
+      if (doneEvent?.conversation_id) {
+        setCurrentConversationId(doneEvent.conversation_id);
+        await loadConversations();
+      }
     } catch (err) {
       const errorMsg = err.response?.data?.error || 'Failed to get answer';
       const errorType = err.response?.data?.error_type;
@@ -204,10 +256,10 @@ const ChatInterface = ({ hasDocuments }) => {
                         onClick={() => loadConversation(conv.id)}
                       >
                         <p className="text-sm font-medium text-text truncate">
-                          {conv.messages[0]?.question || 'Untitled'}
+                          {conv.title || 'Untitled'}
                         </p>
                         <p className="text-xs text-secondary mt-1">
-                          {conv.messages.length} messages • {formatDate(conv.updated_at)}
+                          {conv.message_count} messages • {formatDate(conv.updated_at)}
                         </p>
                       </div>
                       <button
@@ -223,6 +275,14 @@ const ChatInterface = ({ hasDocuments }) => {
                     </div>
                   </div>
                 ))}
+                {conversations.length < conversationsTotal && (
+                  <button
+                    onClick={() => loadConversations(conversations.length)}
+                    className="w-full py-2 text-sm text-primary hover:bg-gray-50 rounded-lg transition-colors"
+                  >
+                    Load more
+                  </button>
+                )}
               </div>
             ) : (
               <p className="text-sm text-secondary text-center py-4">
@@ -273,7 +333,7 @@ const ChatInterface = ({ hasDocuments }) => {
                     {message.sources.map((source, idx) => (
                       <div key={idx} className="text-xs bg-gray-50 rounded p-2">
                         <p className="font-medium text-text">
-                          {source.source} (Chunk {source.chunk + 1})
+                          {source.source} ({source.page ? `Page ${source.page}, ` : ''}Chunk {source.chunk + 1})
                         </p>
                         <p className="text-secondary mt-1">{source.content}</p>
                       </div>
@@ -285,7 +345,7 @@ const ChatInterface = ({ hasDocuments }) => {
           </div>
         ))}
 
-        {loading && (
+        {loading && messages[messages.length - 1]?.role !== 'assistant' && (
           <div className="flex justify-start">
             <div className="bg-white border border-gray-200 rounded-lg p-4">
               <div className="flex items-center gap-2">
@@ -1,28 +1,41 @@
-import { useCallback, useState, useEffect } from 'react';
+import { useCallback, useState, useEffect, useRef } from 'react';
 import { useDropzone } from 'react-dropzone';
 import axios from 'axios';
 
 const API_URL = '/api';
+const DOCUMENTS_PAGE_SIZE = 50;
+const ARCHIVE_EXTENSIONS = ['.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz'];
+
+const isArchive = (filename) => ARCHIVE_EXTENSIONS.some(ext => filename.toLowerCase().endsWith(ext));
 
 const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
   const [uploading, setUploading] = useState(false);
+  const [uploadStatus, setUploadStatus] = useState('');
   const [error, setError] = useState('');
   const [uploadedDocs, setUploadedDocs] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [folders, setFolders] = useState([]);
   const [selectedFolder, setSelectedFolder] = useState('');
   const [newFolderName, setNewFolderName] = useState('');
   const [showNewFolder, setShowNewFolder] = useState(false);
   const [previewDoc, setPreviewDoc] = useState(null);
+  const [updateTarget, setUpdateTarget] = useState(null);
+  const updateInputRef = useRef(null);
 
   useEffect(() => {
     loadDocuments();
     loadFolders();
   }, []);
 
-  const loadDocuments = async () => {
+  const loadDocuments = async (cursor = null) => {
     try {
-      const response = await axios.get(`${API_URL}/documents`);
-      setUploadedDocs(response.data.documents);
+      const response = await axios.get(`${API_URL}/documents`, {
+        params: { limit: DOCUMENTS_PAGE_SIZE, ...(cursor && { cursor }) },
+      });
+      setUploadedDocs(prev => cursor
+        ? [...prev, ...response.data.documents]
+        : response.data.documents);
+      setNextCursor(response.data.next_cursor);
     } catch (err) {
       console.error('Failed to load documents:', err);
     }
@@ -37,10 +50,75 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
     }
   };
 
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const response = await axios.get(`${API_URL}/jobs/${jobId}`);
+      const job = response.data;
+      if (job.status === 'completed') return job.result;
+      if (job.status === 'failed') {
+        const failure = new Error(job.error);
+        failure.response = { data: { error: job.error, error_type: job.error_type } };
+        throw failure;
+      }
+
+      const progress = job.progress || {};
+      if (progress.files_completed !== undefined) {
+        setUploadStatus(`${progress.files_completed} files processed, ${progress.chunks_embedded || 0} chunks embedded...`);
+      } else if (progress.pages_total) {
+        setUploadStatus(`Processed ${progress.pages_extracted || 0}/${progress.pages_total} pages, ${progress.chunks_embedded || 0} chunks embedded...`);
+      } else if (progress.chunks_reused) {
+        setUploadStatus(`${progress.chunks_embedded} chunks processed, ${progress.chunks_reused} unchanged...`);
+      } else if (progress.chunks_embedded) {
+        setUploadStatus(`${progress.chunks_embedded} chunks embedded...`);
+      } else {
+        setUploadStatus(job.status === 'queued' ? 'Queued...' : 'Processing...');
+      }
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
+  const uploadBulk = async (files) => {
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+    if (selectedFolder) {
+      formData.append('folder', selectedFolder);
+    }
+
+    const response = await axios.post(`${API_URL}/upload/bulk`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+    });
+    const result = await waitForJob(response.data.job_id);
+    const problems = result.files.filter(f => f.status !== 'completed');
+    if (problems.length > 0) {
+      setError(`${result.completed} files added. Not added: ${problems.map(f => `${f.filename} (${f.error})`).join(', ')}`);
+    }
+    return result;
+  };
+
   const onDrop = useCallback(async (acceptedFiles) => {
     const file = acceptedFiles[0];
     if (!file) return;
 
+    if (acceptedFiles.length > 1 || isArchive(file.name)) {
+      setUploading(true);
+      setUploadStatus(`Uploading ${acceptedFiles.length} file(s)...`);
+      setError('');
+      try {
+        const result = await uploadBulk(acceptedFiles);
+        await loadDocuments();
+        await loadFolders();
+        if (result.completed > 0) onDocumentUploaded(result);
+      } catch (err) {
+        const errorMsg = err.response?.data?.error || 'Failed to upload files';
+        const errorType = err.response?.data?.error_type;
+        setError(errorType === 'ollama_connection' ? `⚠️ ${errorMsg}` : errorMsg);
+      } finally {
+        setUploading(false);
+        setUploadStatus('');
+      }
+      return;
+    }
+
     const formData = new FormData();
     formData.append('file', file);
     if (selectedFolder) {
@@ -48,6 +126,7 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
     }
 
     setUploading(true);
+    setUploadStatus('Uploading...');
     setError('');
 
     try {
@@ -55,7 +134,8 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
       
-      onDocumentUploaded(response.data);
+      const result = await waitForJob(response.data.job_id);
+      onDocumentUploaded(result);
       await loadDocuments();
       await loadFolders();
     } catch (err) {
@@ -69,6 +149,7 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
       }
     } finally {
       setUploading(false);
+      setUploadStatus('');
     }
   }, [onDocumentUploaded, selectedFolder]);
 
@@ -84,6 +165,40 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
     }
   };
 
+  const handleUpdateClick = (doc) => {
+    setUpdateTarget(doc);
+    updateInputRef.current?.click();
+  };
+
+  const handleUpdateFile = async (e) => {
+    const file = e.target.files[0];
+    e.target.value = '';
+    if (!file || !updateTarget) return;
+
+    const formData = new FormData();
+    formData.append('file', file);
+
+    setUploading(true);
+    setUploadStatus(`Updating ${updateTarget.filename}...`);
+    setError('');
+
+    try {
+      const response = await axios.put(`${API_URL}/documents/${updateTarget.id}`, formData, {
+        headers: { 'Content-Type': 'multipart/form-data' },
+      });
+      await waitForJob(response.data.job_id);
+      await loadDocuments();
+    } catch (err) {
+      const errorMsg = err.response?.data?.error || 'Failed to update document';
+      const errorType = err.response?.data?.error_type;
+      setError(errorType === 'ollama_connection' ? `⚠️ ${errorMsg}` : errorMsg);
+    } finally {
+      setUploading(false);
+      setUploadStatus('');
+      setUpdateTarget(null);
+    }
+  };
+
   const handlePreview = async (doc) => {
     try {
       const response = await axios.get(`${API_URL}/documents/${doc.id}/preview`);
@@ -108,8 +223,13 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
       'application/pdf': ['.pdf'],
       'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
       'text/plain': ['.txt'],
+      'application/zip': ['.zip'],
+      'application/x-tar': ['.tar'],
+      'application/gzip': ['.tar.gz', '.tgz'],
+      'application/x-bzip2': ['.tar.bz2', '.tbz2'],
+      'application/x-xz': ['.tar.xz', '.txz'],
     },
-    multiple: false,
+    multiple: true,
   });
 
   const getFileIcon = (filename) => {
@@ -176,18 +296,26 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
         <input {...getInputProps()} />
         <div className="text-4xl mb-3">📁</div>
         {uploading ? (
-          <p className="text-secondary">Uploading...</p>
+          <p className="text-secondary">{uploadStatus}</p>
         ) : isDragActive ? (
           <p className="text-primary font-medium">Drop the file here</p>
         ) : (
           <div>
             <p className="text-text font-medium mb-1">Drop your document here</p>
             <p className="text-sm text-secondary">or click to browse</p>
-            <p className="text-xs text-secondary mt-2">Supports PDF, DOCX, TXT</p>
+            <p className="text-xs text-secondary mt-2">Supports PDF, DOCX, TXT, or several at once as files or a zip/tar archive</p>
           </div>
         )}
       </div>
 
+      <input
+        ref={updateInputRef}
+        type="file"
+        accept=".pdf,.docx,.txt"
+        className="hidden"
+        onChange={handleUpdateFile}
+      />
+
       {error && (
         <div className="mt-4 p-3 bg-red-50 border border-red-200 rounded-lg text-red-700 text-sm">
           {error}
@@ -224,6 +352,14 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
                     >
                       👁️
                     </button>
+                    <button
+                      onClick={() => handleUpdateClick(doc)}
+                      disabled={uploading}
+                      className="p-1.5 hover:bg-gray-200 rounded transition-colors disabled:opacity-50"
+                      title="Upload revised version"
+                    >
+                      🔄
+                    </button>
                     <button
                       onClick={() => handleDelete(doc.id)}
                       className="p-1.5 hover:bg-red-100 rounded transition-colors"
@@ -234,6 +370,14 @@ const DocumentUpload = ({ onDocumentUploaded, onDocumentDeleted }) => {
                   </div>
                 </div>
               ))}
+              {nextCursor && (
+                <button
+                  onClick={() => loadDocuments(nextCursor)}
+                  className="w-full py-2 text-sm text-primary hover:bg-gray-50 rounded-lg transition-colors"
+                >
+                  Load more
+                </button>
+              )}
             </div>
           </>
         ) : (